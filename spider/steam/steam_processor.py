@@ -1,8 +1,15 @@
 import pandas as pd
+import numpy as np
+import argparse
 import json
+import multiprocessing
 import re
-import random
 import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty
 
 # ==========================================
 # 1. 定义 15 种典型的 Steam 玩家画像
@@ -132,49 +139,292 @@ def clean_price(price_str):
     except:
         return 0.0
 
-def generate_interaction_label(row, profile):
+INTERACTION_COLUMNS = ["user_id", "user_type", "item_id", "title", "price", "tags_list", "tag_names", "cover_url", "label"]
+# 规范化格式: 交互表只留这四列，游戏信息单独存一份 Item 表 (每个游戏一行)，训练 / 服务端按 item_id 接回去
+NORMALIZED_COLUMNS = ["user_id", "user_type", "item_id", "label"]
+ITEM_TABLE_COLUMNS = ["item_id", "title", "price", "tags_list", "tag_names", "cover_url"]
+
+# ==========================================
+# 3.1 向量化打分: 【特定用户】对【特定游戏】的喜好，对所有 (画像, 游戏) 对一次算完
+# 规则: 基础分 0.5；评价含 "好评" +0.1 (跟风党再 +0.2)；每个喜欢的 tag +0.25、讨厌的 -0.4；
+# 价格: 省钱党 >100 -0.3 / <50 +0.1，白嫖怪收费直接置 0 否则 +0.4，土豪 >200 +0.4 / <30 -0.2；
+# 再加 uniform(-0.1, 0.1) 扰动，>= 0.65 记为点击
+# 每种画像编译成 "tag 权重向量 + 价格规则"，游戏侧建一次 Item×Tag 矩阵 (每个游戏第 k 个 tag 的列号)，
+# 于是确定性部分是一个 (画像数 × 游戏数) 的分数表，每条交互只需查表 + 加随机扰动
+# 分数按游戏自己的 tag 顺序逐个加减，与原来逐行计算的浮点累加顺序相同
+# ==========================================
+def compile_profiles(profiles):
     """
-    计算【特定用户】对【特定游戏】的喜好
+    画像 dict -> 数组形式
+    返回 (画像名列表, 涉及的 tag ID, (喜欢, 讨厌) 两个权重矩阵 (P, T+1), 价格规则列表, 是否跟风党 (P,))
+    喜欢的 tag 权重 +0.25，讨厌的 -0.4，分开存是为了同一个 tag 既喜欢又讨厌时先加后减；
+    最后一列是 "不在任何画像里的 tag"，权重为 0
     """
-    score = 0.5
-    tags = row['tags_list']
-    price = row['price']
-    
-    # 1. 基础好评修正 (跟风党特别看重这个)
-    if "好评" in str(row['review_raw']): 
-        score += 0.1
-        if profile == PROFILES["Trend_Follower"]: score += 0.2 # 跟风党加权
-    
-    # 2. 兴趣标签匹配
-    for tag in tags:
-        if tag in profile['fav_tags']: score += 0.25
-        if tag in profile['dislike_tags']: score -= 0.4
-    
-    # 3. 价格敏感度逻辑 (增强版)
-    p_sense = profile['price_sensitive']
-    
-    if p_sense == True: # 普通省钱党
-        if price > 100: score -= 0.3
-        if price < 50: score += 0.1
-    elif p_sense == "Strict": # 白嫖怪
-        if price > 0: score = 0 # 哪怕一块钱也不行 (直接置0)
-        else: score += 0.4
-    elif p_sense == "Inverse": # 土豪
-        if price > 200: score += 0.4
-        if price < 30: score -= 0.2
+    names = list(profiles.keys())
+    tag_ids = sorted({t for p in profiles.values() for t in p['fav_tags'] + p['dislike_tags']})
+    fav, dislike = np.zeros((len(names), len(tag_ids) + 1)), np.zeros((len(names), len(tag_ids) + 1))
+    for i, name in enumerate(names):
+        fav[i, :-1] = 0.25 * np.isin(tag_ids, profiles[name]['fav_tags'])
+        dislike[i, :-1] = 0.4 * np.isin(tag_ids, profiles[name]['dislike_tags'])
+    # price_sensitive 的取值: True 普通省钱党 / "Strict" 白嫖怪 / "Inverse" 土豪 / False 不在乎
+    rules = [p['price_sensitive'] if p['price_sensitive'] in ("Strict", "Inverse") else bool(p['price_sensitive'])
+             for p in profiles.values()]
+    trend = np.array([p == profiles.get("Trend_Follower") for p in profiles.values()])
+    return names, tag_ids, (fav, dislike), rules, trend
+
+def item_tag_matrix(tags_lists, tag_ids):
+    """
+    (游戏数, 最长 tag 数) 的矩阵: 第 i 个游戏第 k 个 tag 在 tag_ids 里的列号
+    不在 tag_ids 里的 tag 和补齐位置都是 len(tag_ids) (权重恒为 0 的那一列)；重复的 tag 会重复出现，重复加分
+    """
+    lengths = np.fromiter(map(len, tags_lists), dtype=np.int64, count=len(tags_lists))
+    flat = np.fromiter((t for tags in tags_lists for t in tags), dtype=np.int64, count=lengths.sum())
+    cols = pd.Index(tag_ids).get_indexer(flat)
+    cols[cols < 0] = len(tag_ids)
+    matrix = np.full((len(tags_lists), max(lengths.max(initial=0), 1)), len(tag_ids))
+    matrix[np.repeat(np.arange(len(tags_lists)), lengths), np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)] = cols
+    return matrix
+
+def score_table(compiled, df_items):
+    """
+    确定性部分的分数表 (P, N)，即上面规则里除随机扰动以外的全部
+    白嫖怪遇到收费游戏时分数直接置 0 (之后仍会加扰动)
+    """
+    names, tag_ids, (fav, dislike), rules, trend = compiled
+    good = df_items['review_raw'].astype(str).str.contains("好评", regex=False).to_numpy()
+    price = df_items['price'].to_numpy(dtype=np.float64)
     
-    # 随机扰动
-    score += random.uniform(-0.1, 0.1)
+    scores = 0.5 + 0.1 * good + 0.2 * np.outer(trend, good)
+    # 按 tag 的位置逐列累加 (最多十几列)，每一列都是对整张 (P, N) 表的数组运算
+    for cols in item_tag_matrix(df_items['tags_list'].tolist(), tag_ids).T:
+        scores += fav[:, cols]
+        scores -= dislike[:, cols]
+    for i, rule in enumerate(rules):
+        if rule is True:
+            scores[i] += -0.3 * (price > 100) + 0.1 * (price < 50)
+        elif rule == "Strict":
+            scores[i] = np.where(price > 0, 0.0, scores[i] + 0.4)
+        elif rule == "Inverse":
+            scores[i] += 0.4 * (price > 200) - 0.2 * (price < 30)
+    return scores
+
+# ==========================================
+# 3.2 按用户确定的随机数: 每个用户的种子只由 (主种子, user_id) 决定，
+# 用户的第 c 个随机数 = splitmix64(用户种子 + c × 黄金比例常数)，是一个纯函数 (counter-based)，
+# 所以不管用户被分到哪个分片、哪个进程、以什么顺序生成，他的交互记录都完全一样
+# 计数器分配: 0 -> 看几个游戏，1..hi -> Floyd 抽样，hi+1..2hi -> 打乱顺序的键，NOISE_COUNTER + k -> 第 k 条交互的扰动
+# ==========================================
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+NOISE_COUNTER = 1 << 32
+
+def _splitmix64(x):
+    with np.errstate(over='ignore'):
+        z = x + _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+def user_seeds(seed, user_ids):
+    return _splitmix64(_splitmix64(np.full(len(user_ids), seed, dtype=np.uint64)) ^ np.asarray(user_ids, dtype=np.uint64))
+
+def user_uniform(seeds, counters):
+    """
+    (用户数, 计数器数) 的 [0, 1) 均匀随机数 (取 64 位里的高 53 位)
+    """
+    with np.errstate(over='ignore'):
+        bits = _splitmix64(seeds[:, None] + np.asarray(counters, dtype=np.uint64)[None, :] * _GOLDEN)
+    return (bits >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+def sample_seen_items(num_items, seeds, min_seen=60, max_seen=100):
+    """
+    每个用户不放回地随机看 min_seen ~ max_seen 个游戏 (与 df_items.sample 同分布)
+    先用 Floyd 算法抽 hi 个不重复的游戏 (第 s 步在 [0, N-hi+s] 里取 t，已经抽过就改取 N-hi+s)，
+    再按 hi 个随机键打乱，取前 k 个: 均匀子集 + 均匀顺序；工作量和内存都只与 hi 有关，与游戏总数无关
+    返回 (n, hi) 的游戏下标矩阵和同形状的 "这一格是否真的看了" 掩码
+    """
+    hi, lo = min(num_items, max_seen), min(num_items, min_seen)
+    u = user_uniform(seeds, np.arange(1 + 2 * hi))
+    sizes = lo + np.floor(u[:, 0] * (hi - lo + 1)).astype(np.int64) if lo > 0 else np.full(len(seeds), num_items)
+    top = np.empty((len(seeds), hi), dtype=np.int64)
+    for s in range(hi):
+        j = num_items - hi + s
+        t = np.floor(u[:, 1 + s] * (j + 1)).astype(np.int64)
+        top[:, s] = np.where((top[:, :s] == t[:, None]).any(axis=1), j, t)
+    top = np.take_along_axis(top, u[:, 1 + hi:].argsort(axis=1), axis=1)
+    return top, np.arange(hi) < sizes[:, None]
+
+def item_columns(df_items):
+    """
+    交互记录里游戏侧的各列 (每个游戏一个值)；tag_names 只跟游戏有关，每个游戏算一次
+    """
+    return {
+        "item_id": df_items['item_id'].to_numpy(),
+        "title": df_items['title'].to_numpy(),
+        "price": df_items['price'].to_numpy(),
+        "tags_list": df_items['tags_raw'].to_numpy(),  # 保持原始字符串给后续处理
+        "tag_names": np.array([",".join([TAG_MAP.get(i, "") for i in tags if i in TAG_MAP][:3])
+                               for tags in df_items['tags_list']], dtype=object),
+        "cover_url": df_items['cover_url'].to_numpy(),
+    }
+
+def iter_interactions(df_items, user_ids, seed, chunk_users=4096, columns=INTERACTION_COLUMNS):
+    """
+    按 chunk_users 个用户一块，依次产出 user_ids 这些虚拟用户的交互记录 (DataFrame，按用户顺序，只含 columns 这些列)
+    画像按 user_id 轮询分配；每个用户的结果只由 (seed, user_id) 决定，与 user_ids 怎么切分无关
+    df_items 需要已经有 tags_list (list) 和 price (float) 两列
+    """
+    compiled = compile_profiles(PROFILES)
+    names = np.array(compiled[0], dtype=object)
+    scores = score_table(compiled, df_items)
+    item_cols = {name: values for name, values in item_columns(df_items).items() if name in columns}
     
-    return 1 if score >= 0.65 else 0
+    for start in range(0, len(user_ids), chunk_users):
+        block = np.asarray(user_ids[start:start + chunk_users], dtype=np.int64)
+        seeds = user_seeds(seed, block)
+        top, seen = sample_seen_items(len(df_items), seeds)
+        users, item_idx = np.broadcast_to(block[:, None], seen.shape)[seen], top[seen]
+        noise = user_uniform(seeds, NOISE_COUNTER + np.arange(seen.shape[1]))[seen] * 0.2 - 0.1
+        profile_idx = users % len(names)
+        chunk = {"user_id": users, "user_type": names[profile_idx]}
+        chunk.update((name, values[item_idx]) for name, values in item_cols.items())
+        chunk["label"] = (scores[profile_idx, item_idx] + noise >= 0.65).astype(np.int64)
+        yield pd.DataFrame(chunk, columns=columns)
+
+def generate_interactions(df_items, user_ids, seed, chunk_users=4096):
+    """
+    一次性生成 user_ids 的全部交互记录 (小数据量 / 调试用，写文件请用 write_users 流式写)
+    """
+    return pd.concat(list(iter_interactions(df_items, user_ids, seed, chunk_users)), ignore_index=True)
+
+def write_users(f, df_items, start, end, seed, chunk_users=4096, report=None, columns=INTERACTION_COLUMNS):
+    """
+    把 [start, end) 这段用户的交互记录一块一块追加写到打开的文本文件 f (不写表头)
+    内存里最多只有一块 (chunk_users 个用户) 的数据；每写完一块调用 report(用户数, 行数)
+    返回 (行数, 正样本数)
+    """
+    rows = positives = 0
+    for chunk in iter_interactions(df_items, np.arange(start, end), seed, chunk_users, columns):
+        chunk.to_csv(f, index=False, header=False)
+        rows += len(chunk)
+        positives += int(chunk['label'].sum())
+        if report is not None:
+            report(chunk['user_id'].nunique(), len(chunk))
+    return rows, positives
+
+class Progress:
+    """
+    生成进度: 已完成的用户数 / 行数、吞吐和预计剩余时间，最多每 interval 秒刷新一行
+    """
+    def __init__(self, total_users, interval=1.0):
+        self.total_users = total_users
+        self.interval = interval
+        self.users = self.rows = 0
+        self.start = self.last = time.perf_counter()
+
+    def update(self, users, rows):
+        self.users += users
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self.last >= self.interval or self.users >= self.total_users:
+            self.last = now
+            rate = self.rows / max(now - self.start, 1e-9)
+            eta = (now - self.start) * (self.total_users - self.users) / max(self.users, 1)
+            print(f"\r   ⏳ 用户 {self.users:,}/{self.total_users:,} ({self.users / max(self.total_users, 1):.1%}) | "
+                  f"{self.rows:,} 条 | {rate:,.0f} 条/秒 | 预计剩余 {eta:.0f}s   ", end="", flush=True)
+
+    def close(self):
+        print()
+
+_progress_queue = None
+
+def _init_worker(queue):
+    global _progress_queue
+    _progress_queue = queue
+
+def _report_to_parent(users, rows):
+    _progress_queue.put((users, rows))
+
+def write_shard(df_items, start, end, seed, path, chunk_users=4096, columns=INTERACTION_COLUMNS):
+    """
+    (子进程里) 把 [start, end) 这段用户流式写成一个不带表头的 CSV 分片，进度通过队列报给父进程
+    """
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        return write_users(f, df_items, start, end, seed, chunk_users, _report_to_parent, columns)
+
+def generate_sharded(df_items, output_file, num_users, seed, workers=1, shard_users=20_000, chunk_users=4096,
+                     columns=INTERACTION_COLUMNS):
+    """
+    按 shard_users 把用户区间切成固定的分片，逐块 (chunk_users 个用户) 生成并流式写盘，内存与总用户数无关
+    单进程时直接按顺序写进输出文件；多进程时每个分片写一个临时文件，父进程按分片顺序一边等一边拼接 (拼完即删)
+    分片边界与进程数无关，每个用户的随机数又只由 (seed, user_id) 决定，所以输出与 workers 无关、逐字节相同
+    先写到 .tmp，完成后原子替换；返回 (总行数, 正样本数)
+    """
+    shards = [(start, min(start + shard_users, num_users)) for start in range(0, num_users, shard_users)]
+    progress = Progress(num_users)
+    tmp = f"{output_file}.tmp"
+    shard_dir = None
+    try:
+        with open(tmp, 'w', encoding='utf-8', newline='') as out:
+            out.write(",".join(columns) + "\n")
+            if workers > 1:
+                shard_dir = tempfile.mkdtemp(prefix='.shards_', dir=os.path.dirname(os.path.abspath(output_file)))
+                paths = [os.path.join(shard_dir, f"{k:05d}.csv") for k in range(len(shards))]
+                results = _run_shards(df_items, shards, paths, seed, workers, chunk_users, columns, out, progress)
+            else:
+                results = [write_users(out, df_items, start, end, seed, chunk_users, progress.update, columns)
+                           for start, end in shards]
+        os.replace(tmp, output_file)
+    finally:
+        progress.close()
+        if shard_dir is not None:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return sum(n for n, _ in results), sum(p for _, p in results)
+
+def _run_shards(df_items, shards, paths, seed, workers, chunk_users, columns, out, progress):
+    # fork: 子进程直接继承已经加载好的模块，df_items 只有几千行，随任务传过去即可；进度队列在建进程时传入
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    results = []
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(queue,)) as pool:
+        futures = [pool.submit(write_shard, df_items, start, end, seed, path, chunk_users, columns)
+                   for (start, end), path in zip(shards, paths)]
+        while len(results) < len(futures):
+            try:
+                progress.update(*queue.get(timeout=0.2))
+            except Empty:
+                pass
+            # 已完成的分片按顺序追加到输出文件
+            while len(results) < len(futures) and futures[len(results)].done():
+                k = len(results)
+                results.append(futures[k].result())
+                out.flush()
+                with open(paths[k], 'r', encoding='utf-8', newline='') as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+                os.remove(paths[k])
+    while not queue.empty():
+        progress.update(*queue.get())
+    return results
+
+def items_path_for(output_file):
+    """
+    Item 表和交互表放在一起: deepfm_train_100k.csv -> deepfm_train_100k_items.csv (与 train/steam_features 的约定相同)
+    """
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_items{ext}"
+
+def write_item_table(df_items, output_file):
+    path = items_path_for(output_file)
+    pd.DataFrame(item_columns(df_items), columns=ITEM_TABLE_COLUMNS).to_csv(path, index=False)
+    return path
 
 # ==========================================
 # 4. 主函数：生成 DeepFM 交互数据集
 # ==========================================
-def generate_deepfm_dataset():
-    input_file = "../../data/steam/steam_raw_data.csv"
-    output_file = "../../data/steam/deepfm_train_100k.csv"
-    
+def generate_deepfm_dataset(input_file="../../data/steam/steam_raw_data.csv",
+                            output_file="../../data/steam/deepfm_train_100k.csv", num_users=1000, seed=2025,
+                            workers=1, shard_users=20_000, chunk_users=4096, output_format="wide"):
     print("🚀 开始构建 DeepFM 交互数据集...")
     
     if not os.path.exists(input_file):
@@ -186,67 +436,41 @@ def generate_deepfm_dataset():
     # 预处理 Items
     df_items['tags_list'] = df_items['tags_raw'].apply(lambda x: json.loads(x) if pd.notna(x) else [])
     df_items['price'] = df_items['price_raw'].apply(clean_price)
+    columns = INTERACTION_COLUMNS
+    if output_format == "normalized":
+        # Item 表按 item_id 一行，重复爬到的游戏只保留第一条
+        df_items = df_items.drop_duplicates('item_id').reset_index(drop=True)
+        columns = NORMALIZED_COLUMNS
     
-    # 2. 生成虚拟用户群 (User Pool)
-    # 生成 1000 个虚拟用户，分配 15 种人设
-    virtual_users = []
-    profile_names = list(PROFILES.keys()) # 获取所有 15 个名字
-    
-    for user_id in range(1000):
-        # 轮询分配：0->FPS, 1->Casual, ... 14->Trend, 15->FPS...
-        p_name = profile_names[user_id % len(profile_names)]
-        
-        virtual_users.append({
-            "user_id": user_id,
-            "user_type": p_name, # 这里的 p_name 会存入 CSV，DeepFM 会学到它！
-            "profile": PROFILES[p_name]
-        })
-    
-    # 3. 生成交互记录 (Interactions)
-    # 让每个用户随机刷 60-100 个游戏
-    all_interactions = []
-    
-    for user in virtual_users:
-        # 随机抽取 60-100 个游戏给这个用户看（但不超过可用游戏数）
-        max_sample = min(len(df_items), 100)
-        min_sample = min(len(df_items), 60)
-        sample_size = random.randint(min_sample, max_sample) if min_sample > 0 else len(df_items)
-        seen_games = df_items.sample(n=sample_size)
-        
-        for _, game in seen_games.iterrows():
-            # 计算 Label
-            label = generate_interaction_label(game, user['profile'])
-            
-            # 构造一条训练样本
-            # ⚠️ 关键：这里既要有 User特征，也要有 Item特征
-            sample = {
-                # User Features
-                "user_id": user['user_id'],
-                "user_type": user['user_type'], # 这是一个很强的特征！
-                
-                # Item Features
-                "item_id": game['item_id'],
-                "title": game['title'],
-                "price": game['price'],
-                "tags_list": game['tags_raw'], # 保持原始字符串给后续处理
-                "tag_names": ",".join([TAG_MAP.get(i, "") for i in game['tags_list'] if i in TAG_MAP][:3]),
-                "cover_url": game['cover_url'],
-                
-                # Label
-                "label": label
-            }
-            all_interactions.append(sample)
-            
-    # 4. 保存
-    df_train = pd.DataFrame(all_interactions)
-    df_train.to_csv(output_file, index=False)
+    # 2. 生成虚拟用户群 (User Pool) 与交互记录 (Interactions)，逐块流式写盘
+    # num_users 个虚拟用户，按 user_id 轮询分配 15 种人设 (0->FPS, 1->Casual, ... 14->Trend, 15->FPS...)，
+    # 每个用户随机刷 60-100 个游戏；user_type 会存入 CSV，DeepFM 会学到它！
+    t0 = time.perf_counter()
+    rows, positives = generate_sharded(df_items, output_file, num_users, seed, workers, shard_users, chunk_users, columns)
+    if output_format == "normalized":
+        items_file = write_item_table(df_items, output_file)
+    elapsed = time.perf_counter() - t0
     
     print(f"✅ DeepFM 训练集构建完成！")
-    print(f"   🎲 虚拟用户数: {len(virtual_users)}")
+    print(f"   🎲 虚拟用户数: {num_users} ({workers} 个进程, 每个分片 {shard_users} 个用户)")
     print(f"   🕹️ 基础游戏数: {len(df_items)}")
-    print(f"   ⚡ 总交互样本数: {len(df_train)} (Target: ~80k)")
+    print(f"   ⚡ 总交互样本数: {rows} (生成 + 写盘耗时 {elapsed:.2f}s, {rows / elapsed:,.0f} 条/秒)")
     print(f"   💾 已保存至: {output_file}")
-    print(f"   📊 正样本点击率: {df_train['label'].mean():.2%}")
+    if output_format == "normalized":
+        print(f"   🗂️ Item 表: {items_file} ({len(df_items)} 个游戏)")
+    print(f"   📊 正样本点击率: {positives / max(rows, 1):.2%}")
 
 if __name__ == "__main__":
-    generate_deepfm_dataset()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="生成 DeepFM 交互数据集")
+    parser.add_argument("--input", default="../../data/steam/steam_raw_data.csv")
+    parser.add_argument("--output", default="../../data/steam/deepfm_train_100k.csv")
+    parser.add_argument("--users", type=int, default=1000, help="虚拟用户数 (每人 60-100 条交互)")
+    parser.add_argument("--seed", type=int, default=2025, help="主种子，每个用户的随机数由 (主种子, user_id) 决定")
+    parser.add_argument("--workers", type=int, default=1, help="生成分片的进程数，不影响输出内容")
+    parser.add_argument("--shard-users", type=int, default=20_000, help="每个分片的用户数")
+    parser.add_argument("--chunk-users", type=int, default=4096, help="每次生成并写盘的用户数 (决定内存上限)")
+    parser.add_argument("--format", choices=["wide", "normalized"], default="wide",
+                        help="wide: 每行带游戏信息；normalized: 精简的交互表 + 旁边的 *_items.csv")
+    args = parser.parse_args()
+    generate_deepfm_dataset(args.input, args.output, args.users, args.seed, args.workers, args.shard_users, args.chunk_users,
+                            args.format)
\ No newline at end of file
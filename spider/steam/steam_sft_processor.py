@@ -1,7 +1,13 @@
 import pandas as pd
+import argparse
 import json
 import ast
+import multiprocessing
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 # ==========================================
 # 1. 完整的 Steam Tag 映射字典 (直接硬编码在这里)
@@ -40,87 +46,149 @@ def get_tag_names(tag_id_list):
     
     return ", ".join(names)
 
-def generate_sft_dataset():
-    input_file = "../../data/steam/steam_raw_data.csv"
-    output_file = "../../data/steam/steam_sft_train.json"
-
-    print(f"⚙️ [SFT] 开始处理数据，读取: {input_file} ...")
+def row_samples(title, tags_raw, reviews_raw, samples):
+    """
+    一个游戏 -> 若干条 SFT 样本 (一条合格的评论一条)，直接追加到 samples 里；评论缺失或为空时什么也不加
+    某条评论出错时抛异常，但之前已经追加的样本保留 (与原来逐行处理的行为一致)
+    """
+    # 解析 Tags (CSV读取后是字符串，需要转回列表)
+    # 兼容处理：有些可能是 float('nan')
+    if pd.isna(tags_raw):
+        tags_list = []
+    elif isinstance(tags_raw, str):
+        tags_list = json.loads(tags_raw) # 或者 ast.literal_eval(tags_raw)
+    else:
+        tags_list = tags_raw
     
-    if not os.path.exists(input_file):
-        print(f"❌ 错误: 找不到 {input_file}，请先运行 Step 1 Plus 爬虫！")
-        return
+    # === 🟢 核心：调用映射字典转中文 ===
+    tag_str_cn = get_tag_names(tags_list)
+    if not tag_str_cn: 
+        tag_str_cn = "未知类型"
 
-    df = pd.read_csv(input_file)
-    sft_data = []
+    # 解析评论 (Reviews)
+    # 我们的爬虫存的是 JSON 字符串 '["评论1", "评论2"]'
+    if pd.isna(reviews_raw):
+        return
+    reviews_list = json.loads(reviews_raw) if isinstance(reviews_raw, str) else reviews_raw
     
-    # 遍历每一行数据
-    for index, row in df.iterrows():
-        try:
-            # 1. 解析基础信息
-            title = row['title']
-            
-            # 2. 解析 Tags (CSV读取后是字符串，需要转回列表)
-            # 兼容处理：有些可能是 float('nan')
-            tags_raw = row['tags_raw']
-            if pd.isna(tags_raw):
-                tags_list = []
-            elif isinstance(tags_raw, str):
-                tags_list = json.loads(tags_raw) # 或者 ast.literal_eval(tags_raw)
-            else:
-                tags_list = tags_raw
-            
-            # === 🟢 核心：调用映射字典转中文 ===
-            tag_str_cn = get_tag_names(tags_list)
-            if not tag_str_cn: 
-                tag_str_cn = "未知类型"
+    # 构造 SFT 数据对 (一对多)
+    # 一个游戏有多条评论，可以生成多条训练数据，极大扩充数据集！
+    for review_content in reviews_list or []:
+        # 稍微清洗一下评论，去掉换行符
+        clean_review = review_content.replace('\n', ' ').strip()
+        
+        # 只有当评论长度适中时才要 (太短没信息量，太长容易超 token)
+        if 5 < len(clean_review) < 500:
+            samples.append({
+                "instruction": f"请以资深玩家的身份，点评一下《{title}》这款游戏。",
+                "input": f"游戏类型标签：{tag_str_cn}",
+                "output": clean_review
+            })
 
-            # 3. 解析评论 (Reviews)
-            # 我们的爬虫存的是 JSON 字符串 '["评论1", "评论2"]'
-            reviews_raw = row['user_reviews']
-            if pd.isna(reviews_raw):
-                continue
-                
-            if isinstance(reviews_raw, str):
-                reviews_list = json.loads(reviews_raw)
-            else:
-                reviews_list = reviews_raw
+# json 在 ensure_ascii=False 时用的字符串转义 (C 实现)；样本是一层全是字符串的 dict，直接拼出文本，
+# 结果与 json.dump(indent=2) / json.dumps 逐字节相同，但不走带缩进时的纯 Python 编码器
+_quote = json.encoder.encode_basestring
 
-            if not reviews_list:
-                continue
+def json_block(sample):
+    """
+    这条样本在 json.dump(列表, ensure_ascii=False, indent=2) 里的文本 (含外层缩进)
+    """
+    return "  {\n" + ",\n".join(f"    {_quote(k)}: {_quote(v)}" for k, v in sample.items()) + "\n  }"
 
-            # 4. 构造 SFT 数据对 (一对多)
-            # 一个游戏有多条评论，可以生成多条训练数据，极大扩充数据集！
-            for review_content in reviews_list:
-                # 稍微清洗一下评论，去掉换行符
-                clean_review = review_content.replace('\n', ' ').strip()
-                
-                # 只有当评论长度适中时才要 (太短没信息量，太长容易超 token)
-                if 5 < len(clean_review) < 500:
-                    sample = {
-                        "instruction": f"请以资深玩家的身份，点评一下《{title}》这款游戏。",
-                        "input": f"游戏类型标签：{tag_str_cn}",
-                        "output": clean_review
-                    }
-                    sft_data.append(sample)
+def json_line(sample):
+    """
+    与 json.dumps(sample, ensure_ascii=False) 相同
+    """
+    return "{" + ", ".join(f"{_quote(k)}: {_quote(v)}" for k, v in sample.items()) + "}"
 
+def render_chunk(chunk, output_format):
+    """
+    一块原始数据 -> (序列化好的文本, 游戏数, 样本数, 第一条样本)，可以在子进程里跑
+    jsonl: 每条样本一行；json: 每条样本按 json.dump(indent=2) 在列表里的样子缩进，样本之间用 ",\n" 连接
+    """
+    samples = []
+    for index, title, tags_raw, reviews_raw in chunk[['title', 'tags_raw', 'user_reviews']].itertuples(name=None):
+        try:
+            row_samples(title, tags_raw, reviews_raw, samples)
         except Exception as e:
             # 打印错误但不中断，方便调试
             print(f"⚠️ 跳过第 {index} 行: {e}")
-            continue
+    if output_format == "jsonl":
+        text = "".join(json_line(sample) + "\n" for sample in samples)
+    else:
+        text = ",\n".join(json_block(sample) for sample in samples)
+    return text, len(chunk), len(samples), samples[0] if samples else None
+
+def map_chunks(fn, chunks, workers):
+    """
+    按顺序产出 fn(chunk) 的结果；workers > 1 时放进进程池，最多 2 × workers 块在途，内存与文件大小无关
+    """
+    if workers <= 1:
+        yield from map(fn, chunks)
+        return
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(fn, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def generate_sft_dataset(input_file="../../data/steam/steam_raw_data.csv", output_file=None, output_format="json",
+                         chunk_rows=1000, workers=1):
+    """
+    按 chunk_rows 个游戏一块读原始 CSV，生成样本后立刻追加写盘，不在内存里攒整份数据集
+    output_format: json (LLaMA-Factory 的 Alpaca 列表，与一次性 json.dump(indent=2) 逐字节相同) 或 jsonl (一行一条)
+    """
+    output_file = output_file or f"../../data/steam/steam_sft_train.{output_format}"
+
+    print(f"⚙️ [SFT] 开始处理数据，读取: {input_file} ...")
+    
+    if not os.path.exists(input_file):
+        print(f"❌ 错误: 找不到 {input_file}，请先运行 Step 1 Plus 爬虫！")
+        return
 
-    # 保存为 JSON (LLaMA-Factory 标准格式)
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(sft_data, f, ensure_ascii=False, indent=2)
+    t0 = time.perf_counter()
+    num_games = num_samples = 0
+    preview = None
+    chunks = pd.read_csv(input_file, usecols=['title', 'tags_raw', 'user_reviews'], chunksize=chunk_rows)
+    tmp = f"{output_file}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        if output_format == "json":
+            f.write("[")
+        for text, games, samples, first in map_chunks(partial(render_chunk, output_format=output_format), chunks, workers):
+            if output_format == "json" and samples:
+                f.write(",\n" if num_samples else "\n")
+            f.write(text)
+            num_games += games
+            num_samples += samples
+            preview = preview or first
+        if output_format == "json":
+            # 没有样本时是 "[]"，与 json.dump([]) 一致
+            f.write("\n]" if num_samples else "]")
+    os.replace(tmp, output_file)
+    elapsed = time.perf_counter() - t0
 
     print(f"\n✅ SFT 数据集构建完成！")
-    print(f"   📊 原始游戏数: {len(df)}")
-    print(f"   🚀 生成微调样本数: {len(sft_data)} (一个游戏对应多条评论)")
+    print(f"   📊 原始游戏数: {num_games}")
+    print(f"   🚀 生成微调样本数: {num_samples} (一个游戏对应多条评论)")
+    print(f"   ⚡ 耗时 {elapsed:.2f}s ({num_samples / elapsed:,.0f} 条/秒, {os.path.getsize(output_file) / 2**20 / elapsed:.1f} MB/秒, "
+          f"{output_format}, {workers} 个进程)")
     print(f"   💾 已保存至: {output_file}")
     
     # 打印一条预览看看效果
-    if sft_data:
+    if preview:
         print("\n🔎 数据样本预览:")
-        print(json.dumps(sft_data[0], ensure_ascii=False, indent=2))
+        print(json.dumps(preview, ensure_ascii=False, indent=2))
 
 if __name__ == "__main__":
-    generate_sft_dataset()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="生成 SFT 指令微调数据集")
+    parser.add_argument("--input", default="../../data/steam/steam_raw_data.csv")
+    parser.add_argument("--output", default=None, help="默认 ../../data/steam/steam_sft_train.<format>")
+    parser.add_argument("--format", choices=["json", "jsonl"], default="json",
+                        help="json: LLaMA-Factory 的 Alpaca 列表；jsonl: 一行一条，可流式读取")
+    parser.add_argument("--chunk-rows", type=int, default=1000, help="每块读入的游戏数")
+    parser.add_argument("--workers", type=int, default=1, help="处理各块的进程数，不影响输出内容")
+    args = parser.parse_args()
+    generate_sft_dataset(args.input, args.output, args.format, args.chunk_rows, args.workers)
@@ -0,0 +1,324 @@
+import argparse
+import ast
+import copy
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from sklearn.preprocessing import LabelEncoder, MinMaxScaler
+from deepctr_torch.models import DeepFM
+
+import steam_cache
+import steam_service
+import steam_train
+from steam_service import top_k_indices, build_item_columns, build_results
+from steam_distributed import fit_distributed
+from steam_features import (artifacts_path_for, build_feature_columns, build_input_tensor, pad_tag_ids,
+                            parse_tag_lists, read_interactions, save_artifacts)
+from steam_retrieval import build_retriever
+
+# ==========================================
+# 🧪 steam_service 热点路径的微基准
+# 用法: python steam_benchmark.py rank --sizes 10000 100000 1000000
+#       python steam_benchmark.py retrieval --sizes 10000 100000 1000000
+#       python steam_benchmark.py tags --sizes 100000 1000000 --csv ../data/steam/deepfm_train_100k.csv
+#       python steam_benchmark.py cache --csv ../data/steam/deepfm_train_100k.csv
+#       python steam_benchmark.py ddp --nproc 1 2 4 --epochs 3
+# ==========================================
+
+def timeit(fn, repeat=5):
+    """
+    跑 repeat 次，返回中位数耗时 (ms) 和最后一次的结果
+    """
+    costs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        costs.append((time.perf_counter() - t0) * 1000)
+    return float(np.median(costs)), out
+
+def make_item_frame(n, seed=2025):
+    """
+    构造 n 个游戏的假 Item 表 (字段与 steam_service 的 item_df 一致)
+    """
+    rng = np.random.default_rng(seed)
+    item_ids = rng.permutation(n * 4)[:n] + 10
+    return pd.DataFrame({
+        'item_id': item_ids,
+        'title': [f"Game {i}" for i in item_ids],
+        'cover_url': [f"https://example.com/{i}.jpg" for i in item_ids],
+        'tag_names': np.array(["动作,射击", "RPG", "休闲,模拟", ""], dtype=object)[rng.integers(0, 4, n)],
+        'item_id_idx': np.arange(n),
+        'price_norm': rng.random(n),
+    })
+
+def write_synthetic_model(out_dir, num_items, num_types=15, num_tags=200, seed=2025):
+    """
+    在 out_dir 下生成一份假的训练产物: 随机 DeepFM 权重 + 对应的 artifacts bundle (num_items 个游戏)
+    embedding 按训练后的量级 (std=0.1) 重新初始化，让 FM 项和 DNN 项都对排序有贡献
+    返回权重文件路径，artifacts 路径按 artifacts_path_for 推出
+    """
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    feature_spec = {'item_id_idx': num_items, 'user_type_idx': num_types, 'tags': num_tags + 1,
+                    'embedding_dim': 32, 'max_tag_len': 5}
+    model_spec = {'dnn_hidden_units': (128, 64), 'dnn_dropout': 0.5}
+    cols = build_feature_columns(feature_spec)
+    model = DeepFM(linear_feature_columns=cols, dnn_feature_columns=cols, task='binary', device='cpu', **model_spec)
+    for name, param in model.named_parameters():
+        if 'embedding_dict' in name:
+            nn.init.normal_(param, std=0.1)
+    weights_path = os.path.join(out_dir, 'deepfm_steam_weights.pth')
+    torch.save(model.state_dict(), weights_path)
+    
+    items = make_item_frame(num_items, seed).sort_values('item_id').reset_index(drop=True)
+    items['item_id_idx'] = np.arange(num_items)  # 与 LabelEncoder 一样按 item_id 升序编号
+    tags = rng.integers(1, num_tags + 1, (num_items, feature_spec['max_tag_len']))
+    tags[np.arange(feature_spec['max_tag_len']) >= rng.integers(1, feature_spec['max_tag_len'] + 1, (num_items, 1))] = 0
+    item_table = {col: items[col].to_numpy() for col in
+                  ['item_id', 'title', 'cover_url', 'tag_names', 'item_id_idx', 'price_norm']}
+    item_table['tags'] = tags
+    encoders = {
+        'tags': np.array([f"tag_{i}" for i in range(num_tags)]),
+        'item_id': item_table['item_id'],
+        'user_type': np.array([f"Type_{i:02d}" for i in range(num_types)]),
+    }
+    scaler = MinMaxScaler().fit([[0.0], [100.0]])
+    save_artifacts(artifacts_path_for(weights_path), encoders, scaler, feature_spec, model_spec,
+                   item_table, weights_path)
+    return weights_path
+
+def load_synthetic_state(out_dir, num_items):
+    """
+    生成假模型并走 steam_service 的正常加载路径 (不建打分表、不建召回层)
+    """
+    weights_path = write_synthetic_model(out_dir, num_items)
+    steam_service.cfg.MODEL_PATH = weights_path
+    steam_service.cfg.ARTIFACTS_PATH = artifacts_path_for(weights_path)
+    steam_service.cfg.SCORE_TABLE = False
+    steam_service.cfg.RETRIEVAL = False
+    return steam_service.build_state()
+
+def legacy_rank(df, scores, top_k):
+    """
+    旧版排序路径: 复制整表 -> 全量 sort_values -> 去重 -> iterrows 拼 JSON
+    """
+    res_df = df.copy()
+    res_df['score'] = scores
+    top_items = res_df.sort_values(by='score', ascending=False).drop_duplicates(subset=['item_id']).head(top_k)
+    return [{
+        "id": str(r['item_id']),
+        "title": r['title'],
+        "score": float(r['score']),
+        "cover": r.get('cover_url', ''),
+        "tags": r.get('tag_names', '')
+    } for _, r in top_items.iterrows()]
+
+def make_tag_column(n, num_tags=400, max_len=8, seed=2025):
+    """
+    构造 n 行与 CSV 同格式的 tags_list 字符串列 ("[4172, 122, 1695]")，长度 0 ~ max_len，tag 为原始 Steam tag id
+    """
+    rng = np.random.default_rng(seed)
+    vocab = rng.permutation(20_000)[:num_tags] + 1
+    lengths = rng.integers(0, max_len + 1, n)
+    ids = vocab[rng.integers(0, num_tags, lengths.sum())]
+    rows = np.split(ids, np.cumsum(lengths)[:-1])
+    return pd.Series(['[' + ', '.join(map(str, r)) + ']' for r in rows])
+
+def legacy_encode_tags(values, max_len):
+    """
+    旧版 Tags 处理: 逐行 ast.literal_eval -> 逐行 LabelEncoder.transform -> Python 循环补齐
+    """
+    seqs = values.apply(lambda x: ast.literal_eval(x))
+    tag_lbe = LabelEncoder()
+    tag_lbe.fit([tag for sublist in seqs for tag in sublist])
+    seqs = seqs.apply(lambda x: [i+1 for i in tag_lbe.transform(x)] if len(x)>0 else [])
+    result = np.full((len(seqs), max_len), 0, dtype=np.int32)
+    for i, seq in enumerate(seqs):
+        if len(seq) > 0:
+            trunc = seq[:max_len]
+            result[i, :len(trunc)] = trunc
+    return tag_lbe.classes_, result
+
+def vectorized_encode_tags(values, max_len):
+    """
+    现在 load_steam_data / load_data_struct 的路径: 整列一次解析、一次查表、直接写进补齐矩阵
+    """
+    all_tags, lengths = parse_tag_lists(values)
+    tag_lbe = LabelEncoder()
+    tag_lbe.fit(all_tags)
+    return tag_lbe.classes_, pad_tag_ids(tag_lbe.transform(all_tags) + 1, lengths, max_len, dtype=np.int32)
+
+def bench_tags(args):
+    columns = [(f"{n}", make_tag_column(n)) for n in args.sizes]
+    if args.csv:
+        columns.append((os.path.basename(args.csv), read_interactions(args.csv)['tags_list']))
+    print(f"{'rows':>28} | {'legacy(ms)':>10} | {'vector(ms)':>10} | {'speedup':>7}")
+    for name, values in columns:
+        t_old, old = timeit(lambda: legacy_encode_tags(values, args.max_len), args.repeat)
+        t_new, new = timeit(lambda: vectorized_encode_tags(values, args.max_len), args.repeat)
+        # 词表和 id 矩阵都必须与旧路径逐位一致，训练好的模型才能直接沿用
+        assert np.array_equal(old[0], new[0]) and old[1].dtype == new[1].dtype and np.array_equal(old[1], new[1]), \
+            f"结果不一致: {name}"
+        print(f"{name + f' ({len(values)})':>28} | {t_old:>10.1f} | {t_new:>10.1f} | {t_old / t_new:>6.1f}x")
+
+def bench_cache(args):
+    """
+    load_features 三种情况的耗时: 不用缓存 (解析 CSV) / 冷缓存 (解析 + 写缓存) / 热缓存 (memory-map)
+    热缓存另计把各列完整读一遍 (触发 page fault) 的耗时，并断言与直接解析的结果一致
+    """
+    print(f"{'csv':>28} | {'rows':>8} | {'parse(ms)':>9} | {'cold(ms)':>9} | {'warm(ms)':>9} | {'warm+read(ms)':>13} | {'speedup':>7}")
+    for csv_path in args.csv:
+        t_parse, (ref, _) = timeit(lambda: steam_cache.load_features(csv_path, args.max_len), args.repeat)
+        with tempfile.TemporaryDirectory() as tmp:
+            t0 = time.perf_counter()
+            steam_cache.load_features(csv_path, args.max_len, tmp)
+            t_cold = (time.perf_counter() - t0) * 1000
+            t_warm, (cols, meta) = timeit(lambda: steam_cache.load_features(csv_path, args.max_len, tmp), args.repeat)
+            t_read, _ = timeit(lambda: [np.asarray(cols[name]).sum() for name in steam_cache.COLUMNS], 1)
+            for name in steam_cache.COLUMNS:
+                assert ref[name].dtype == cols[name].dtype and np.array_equal(ref[name], cols[name]), f"{name} 不一致"
+        name = os.path.basename(csv_path)
+        print(f"{name:>28} | {meta['num_rows']:>8} | {t_parse:>9.1f} | {t_cold:>9.1f} | {t_warm:>9.1f} | "
+              f"{t_warm + t_read:>13.1f} | {t_parse / t_warm:>6.0f}x")
+
+def bench_ddp(args):
+    """
+    数据并行训练的扩展性: 同一份数据、同样的初始化，按不同进程数各训练 --epochs 个 epoch (不早停)
+    samples/sec 取各 epoch 的中位数 (只计训练，不含验证)，同时记录最好的 val_auc；fit 一行是单进程 DeepFM.fit 的参照
+    """
+    input_dict, linear_cols, dnn_cols, target, _ = steam_train.load_steam_data(args.csv, steam_train.cfg)
+    split_at = int(len(target) * (1. - steam_train.cfg.VALIDATION_SPLIT))
+
+    def fresh_model():
+        torch.manual_seed(steam_train.cfg.SEED)
+        return DeepFM(linear_feature_columns=linear_cols, dnn_feature_columns=dnn_cols, task='binary', device='cpu',
+                      dnn_hidden_units=steam_train.cfg.DNN_HIDDEN_UNITS, dnn_dropout=steam_train.cfg.DNN_DROPOUT)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        config = copy.copy(steam_train.cfg)
+        config.EPOCHS, config.PATIENCE = args.epochs, args.epochs
+        config.MODEL_PATH = os.path.join(tmp, 'weights.pth')
+
+        model = fresh_model()
+        model.compile(optimizer=optim.Adam(model.parameters(), lr=config.LEARNING_RATE), loss="binary_crossentropy",
+                      metrics=["binary_crossentropy", "auc"])
+        t0 = time.perf_counter()
+        history = model.fit(input_dict, target, batch_size=config.BATCH_SIZE, epochs=config.EPOCHS, verbose=0,
+                            validation_split=config.VALIDATION_SPLIT)
+        rows.append({'mode': 'fit', 'processes': 1,
+                     'samples_per_sec': split_at * args.epochs / (time.perf_counter() - t0),
+                     'best_val_auc': max(history.history['val_auc'])})
+
+        for nproc in args.nproc:
+            model = fresh_model()
+            X = build_input_tensor(model.feature_index, input_dict, len(target))
+            history = fit_distributed(model, X, torch.tensor(target, dtype=torch.float32), config, nproc)
+            rows.append({'mode': 'ddp', 'processes': nproc,
+                         'samples_per_sec': float(np.median(history['samples_per_sec'])),
+                         'best_val_auc': max(history['val_auc'])})
+
+    base = next(r['samples_per_sec'] for r in rows if r['mode'] == 'ddp' and r['processes'] == min(args.nproc))
+    print(f"{'mode':>5} | {'procs':>5} | {'samples/s':>10} | {'scaling':>7} | {'best val_auc':>12}")
+    for r in rows:
+        r['scaling'] = r['samples_per_sec'] / base
+        print(f"{r['mode']:>5} | {r['processes']:>5} | {r['samples_per_sec']:>10.0f} | {r['scaling']:>6.2f}x | "
+              f"{r['best_val_auc']:>12.4f}")
+    if args.output:
+        report = {'csv': args.csv, 'epochs': args.epochs, 'train_samples': split_at, 'cpu_count': os.cpu_count(),
+                  'batch_size_per_process': steam_train.cfg.BATCH_SIZE, 'results': rows}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📊 报告已保存: {args.output}")
+
+def bench_rank(args):
+    print(f"{'rows':>9} | {'top_k':>5} | {'legacy(ms)':>10} | {'topk(ms)':>9} | {'speedup':>7}")
+    for n in args.sizes:
+        df = make_item_frame(n)
+        columns = build_item_columns(df)
+        scores = np.random.default_rng(n).random(n).astype(np.float32)
+        for top_k in args.top_k:
+            t_old, old = timeit(lambda: legacy_rank(df, scores, top_k), args.repeat)
+            t_new, new = timeit(lambda: build_results(columns, top_k_indices(scores, top_k), scores), args.repeat)
+            # 输出必须和旧路径完全一致
+            assert old == new, f"结果不一致: rows={n}, top_k={top_k}"
+            print(f"{n:>9} | {top_k:>5} | {t_old:>10.2f} | {t_new:>9.3f} | {t_old / t_new:>6.1f}x")
+
+def bench_retrieval(args):
+    """
+    全量打分 vs 召回 + DeepFM 精排: 以全量打分的 Top-K 为真值算 recall@k，耗时为单个类型一次现场打分 + 排序
+    """
+    indexes = [('exact', None)] + [('ivf', nprobe) for nprobe in args.nprobe]
+    print(f"{'items':>9} | {'index':>10} | {'build(s)':>8} | {'full(ms)':>8} | {'2stage(ms)':>10} | {'speedup':>7} | "
+          + " | ".join(f"recall@{k:<3}" for k in args.top_k))
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            st = load_synthetic_state(tmp, n)
+        types = np.arange(len(st.user_lbe.classes_))
+        t_full, _ = timeit(lambda: [steam_service.rank_items(steam_service.score_user_types([t], st)[0], 50, st)
+                                    for t in types], args.repeat)
+        truth = steam_service.score_user_types(types, st)
+        for kind, nprobe in indexes:
+            t0 = time.perf_counter()
+            st.retriever = build_retriever(st.model, st.item_inputs, kind, args.candidates, nprobe=nprobe or 8)
+            build_cost = time.perf_counter() - t0
+            t_two, _ = timeit(lambda: [steam_service.rank_items(steam_service.score_candidates([t], st)[0], 50, st)
+                                       for t in types], args.repeat)
+            two = steam_service.score_candidates(types, st)
+            recalls = []
+            for k in args.top_k:
+                hits = [len(np.intersect1d(top_k_indices(truth[t], k), top_k_indices(two[t], k))) / k for t in types]
+                recalls.append(float(np.mean(hits)))
+            name = kind if nprobe is None else f"ivf/{nprobe}"
+            # 耗时按每个请求 (单个类型) 平均
+            print(f"{n:>9} | {name:>10} | {build_cost:>8.2f} | {t_full / len(types):>8.2f} | "
+                  f"{t_two / len(types):>10.2f} | {t_full / t_two:>6.1f}x | "
+                  + " | ".join(f"{r:>10.3f}" for r in recalls))
+        st.retriever = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="steam_service 微基准")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("rank", help="对比旧版 sort_values 排序与 argpartition Top-K")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p.add_argument("--top-k", type=int, nargs="+", default=[3, 50])
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_rank)
+
+    p = sub.add_parser("retrieval", help="召回 + 精排 与全量打分的 recall@k 和耗时对比 (合成目录)")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p.add_argument("--candidates", type=int, default=300)
+    p.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    p.add_argument("--top-k", type=int, nargs="+", default=[10, 50])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_retrieval)
+
+    p = sub.add_parser("tags", help="对比逐行 ast + LabelEncoder + 补齐循环 与向量化 Tags 编码")
+    p.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    p.add_argument("--csv", default=None, help="额外用真实 CSV 的 tags_list 列测一次")
+    p.add_argument("--max-len", type=int, default=5)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_tags)
+
+    p = sub.add_parser("cache", help="特征缓存: 解析 CSV vs memory-map 缓存")
+    p.add_argument("--csv", nargs="+", required=True)
+    p.add_argument("--max-len", type=int, default=5)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_cache)
+
+    p = sub.add_parser("ddp", help="数据并行训练: samples/sec 与 val_auc 随进程数的变化")
+    p.add_argument("--csv", default=steam_train.cfg.CSV_PATH)
+    p.add_argument("--nproc", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--epochs", type=int, default=3)
+    p.add_argument("--output", default="ddp_scaling_report.json")
+    p.set_defaults(func=bench_ddp)
+
+    args = parser.parse_args()
+    args.func(args)
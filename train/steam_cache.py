@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder, MinMaxScaler
+from steam_features import (build_item_table, file_sha256, items_path_for, join_items, pad_tag_ids, parse_tag_lists,
+                            read_items, scaler_params)
+from steam_profile import profiler
+
+# ==========================================
+# 🗃️ 特征缓存: CSV 编码一次，之后直接 memory-map
+# 键 = CSV 内容的 sha256 (规范化格式再加上 Item 表的) + 预处理参数 (MAX_TAG_LEN 等) + 缓存格式版本，任何一项变了都会重新编码
+# 每个缓存是一个目录: 每列一个 .npy (np.load(mmap_mode='c') 打开，不解析、不拷贝；写时复制，永远不会改到缓存文件)，
+# 外加 meta.pkl (编码器、归一化参数、Item 表，大小只随游戏数 / tag 数增长)
+# ==========================================
+CACHE_VERSION = 1
+COLUMNS = ['item_id_idx', 'user_type_idx', 'price_norm', 'tags', 'label']
+DIGEST_INDEX = 'csv_digests.json'
+
+def encode_csv(csv_path, max_tag_len):
+    """
+    读整份 CSV 并编码: 编码器都在这份数据上 fit，tag id = LabelEncoder 下标 + 1 (0 为 padding)
+    规范化格式 (交互表 + Item 表) 时每个游戏的 tags 只解析、编码一次，再按行号展开，结果与宽表逐位相同
+    返回 (列数组 dict, meta)
+    """
+    with profiler.stage('read_csv'):
+        data = pd.read_csv(csv_path)
+        items = read_items(csv_path)
+    if items is not None:
+        with profiler.stage('join_items'):
+            data, rows, items = join_items(data, items, ['title', 'price', 'tag_names', 'cover_url'])
+
+    with profiler.stage('parse_tags'):
+        all_tags, tag_lengths = parse_tag_lists(data['tags_list'] if items is None else items['tags_list'])
+    with profiler.stage('encode_tags'):
+        # 只保留被引用到的游戏，所以 Item 表里的 tag 集合与逐行展开后的相同
+        tag_lbe = LabelEncoder()
+        tag_lbe.fit(all_tags)
+        tags_padded = pad_tag_ids(tag_lbe.transform(all_tags) + 1, tag_lengths, max_tag_len, dtype=np.int32)
+        if items is not None:
+            tags_padded = tags_padded[rows]
+
+    with profiler.stage('label_encode'):
+        item_lbe = LabelEncoder()
+        data['item_id_idx'] = item_lbe.fit_transform(data['item_id'])
+        user_lbe = LabelEncoder()
+        data['user_type_idx'] = user_lbe.fit_transform(data['user_type'])
+    with profiler.stage('scale_price'):
+        mms = MinMaxScaler(feature_range=(0, 1))
+        data['price_norm'] = mms.fit_transform(data[['price']])[:, 0]
+
+    # copy-on-write 下 to_numpy() 返回只读视图，torch.from_numpy 会告警；复制一份，与缓存命中时的可写数组一致
+    columns = {
+        'item_id_idx': data['item_id_idx'].to_numpy(copy=True),
+        'user_type_idx': data['user_type_idx'].to_numpy(copy=True),
+        'price_norm': data['price_norm'].to_numpy(copy=True),
+        'tags': tags_padded,
+        'label': data['label'].to_numpy(copy=True),
+    }
+    with profiler.stage('item_table'):
+        item_table = build_item_table(data, tags_padded)
+    meta = {
+        'encoders': {'tags': tag_lbe.classes_, 'item_id': item_lbe.classes_, 'user_type': user_lbe.classes_},
+        'scaler': scaler_params(mms),
+        'item_table': item_table,
+        'max_tag_len': max_tag_len,
+        'num_rows': len(data),
+    }
+    return columns, meta
+
+def feature_spec_from(meta, embedding_dim):
+    """
+    meta -> build_feature_columns 需要的特征规格 (词表大小 + embedding 维度)
+    """
+    return {
+        'item_id_idx': len(meta['encoders']['item_id']),
+        'user_type_idx': len(meta['encoders']['user_type']),
+        'tags': len(meta['encoders']['tags']) + 1,
+        'embedding_dim': embedding_dim,
+        'max_tag_len': meta['max_tag_len'],
+    }
+
+def csv_digest(csv_path, cache_dir):
+    """
+    CSV 的 sha256。按 (绝对路径, 大小, mtime_ns) 记在缓存目录的索引里，文件没动过就不重新读一遍算哈希
+    """
+    path = os.path.abspath(csv_path)
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, DIGEST_INDEX)
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = {}
+    entry = index.get(path)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+    digest = file_sha256(path)
+    index[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    tmp = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, index_path)
+    return digest
+
+def cache_key(csv_path, max_tag_len, cache_dir):
+    params = {'csv_sha256': csv_digest(csv_path, cache_dir), 'max_tag_len': max_tag_len, 'version': CACHE_VERSION}
+    if os.path.exists(items_path_for(csv_path)):
+        params['items_sha256'] = csv_digest(items_path_for(csv_path), cache_dir)
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+def write_cache(cache_dir, key, columns, meta):
+    """
+    先写进临时目录再整体 rename，中途失败或多个进程同时写都不会留下半个缓存
+    """
+    final = os.path.join(cache_dir, key[:16])
+    tmp = os.path.join(cache_dir, f".{key[:16]}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in COLUMNS:
+        np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(columns[name]))
+    with open(os.path.join(tmp, 'meta.pkl'), 'wb') as f:
+        pickle.dump(dict(meta, key=key, version=CACHE_VERSION), f, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        os.rename(tmp, final)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # 别的进程已经写好了同一个键
+    return final
+
+def open_cache(cache_dir, key):
+    """
+    命中时返回 (memory-map 的列数组 dict, meta)，未命中返回 None
+    用写时复制模式映射: 数组可写 (torch.from_numpy 不会告警)，改动只留在本进程内存里
+    """
+    path = os.path.join(cache_dir, key[:16])
+    try:
+        with open(os.path.join(path, 'meta.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    if meta.get('key') != key or meta.get('version') != CACHE_VERSION:
+        return None
+    columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='c') for name in COLUMNS}
+    return columns, meta
+
+def load_features(csv_path, max_tag_len, cache_dir=None):
+    """
+    编码后的特征列 + meta；cache_dir 为 None 时不用缓存，直接编码
+    """
+    if cache_dir is None:
+        with profiler.stage('encode_csv'):
+            return encode_csv(csv_path, max_tag_len)
+    os.makedirs(cache_dir, exist_ok=True)
+    with profiler.stage('cache_key'):
+        key = cache_key(csv_path, max_tag_len, cache_dir)
+    with profiler.stage('open_cache'):
+        cached = open_cache(cache_dir, key)
+    if cached is not None:
+        print(f"🗃️ 命中特征缓存: {os.path.join(cache_dir, key[:16])} ({cached[1]['num_rows']} 行)")
+        return cached
+    with profiler.stage('encode_csv'):
+        columns, meta = encode_csv(csv_path, max_tag_len)
+    with profiler.stage('write_cache'):
+        path = write_cache(cache_dir, key, columns, meta)
+    print(f"🗃️ 特征缓存已写入: {path}")
+    return columns, meta
@@ -0,0 +1,142 @@
+import os
+import random
+import numpy as np
+import torch
+from deepctr_torch.callbacks import Callback, EarlyStopping
+
+# ==========================================
+# 💾 训练断点: 每个 epoch 结束保存 模型 + 优化器 + 已完成的 epoch 数 + 随机数状态 + 最好的 val_auc + 早停计数 + 历史指标
+# last.pt 始终是最近保存的 epoch，best.pt 是 val_auc 最好的 epoch (训练结束后默认用它作为最终权重)
+# --resume 从 last.pt 恢复全部状态后接着训，后续每个 epoch 的数值与不中断时逐位一致
+# ==========================================
+CHECKPOINT_VERSION = 1
+
+def rng_state():
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def load_checkpoint(path):
+    # 断点里有 numpy / python 的随机数状态，不是纯张量，需要 weights_only=False (文件是自己训练时写的)
+    state = torch.load(path, map_location='cpu', weights_only=False)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"断点版本不匹配: {state.get('version')} != {CHECKPOINT_VERSION}")
+    return state
+
+class CheckpointManager:
+    """
+    管理一个断点目录: save() 每 every 个 epoch 覆盖一次 last.pt，val_auc 创新高时同时写 best.pt
+    meta 记录数据 / 模型规格和训练模式，恢复时不一致就拒绝 (换了数据或结构的断点不能接着训)
+    """
+    def __init__(self, directory, meta, every=1):
+        self.directory = directory
+        self.meta = meta
+        self.every = every
+        self.best_auc = -np.inf
+        self.last_path = os.path.join(directory, 'last.pt')
+        self.best_path = os.path.join(directory, 'best.pt')
+
+    def resume(self):
+        """
+        读取 last.pt 并校验；返回断点 dict (调用方负责把状态装回模型 / 优化器 / 随机数生成器)
+        """
+        if not os.path.exists(self.last_path):
+            raise FileNotFoundError(f"没有可恢复的断点: {self.last_path}")
+        state = load_checkpoint(self.last_path)
+        for key, value in self.meta.items():
+            if state['meta'].get(key) != value:
+                raise ValueError(f"断点与当前配置不一致 ({key}): {state['meta'].get(key)} != {value}")
+        self.best_auc = state['best_val_auc']
+        return state
+
+    def _write(self, path, state):
+        # 先写临时文件再替换，保存到一半被杀掉也不会损坏已有的断点
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.tmp"
+        torch.save(state, tmp)
+        os.replace(tmp, path)
+
+    def save(self, epoch, model, optimizer, history, wait, rng, stopped=False, final=False, extra=None):
+        """
+        epoch 为已完成的 epoch 数；history 为到目前为止的全部指标 (含本 epoch)；wait 为早停计数
+        rng 为 rng_state() 的结果 (多进程时是各 rank 的列表)；早停 (stopped) 或最后一个 epoch (final) 时一定写 last.pt
+        extra 为训练循环自己需要恢复的其它状态
+        """
+        val_auc = history.get('val_auc', [None])[-1]
+        improved = val_auc is not None and val_auc > self.best_auc
+        if improved:
+            self.best_auc = val_auc
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'meta': self.meta,
+            'epoch': epoch,
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'rng': rng,
+            'best_val_auc': self.best_auc,
+            'wait': wait,
+            'history': history,
+            'stopped': stopped,
+            **(extra or {}),
+        }
+        if improved:
+            self._write(self.best_path, state)
+        if stopped or final or epoch % self.every == 0:
+            self._write(self.last_path, state)
+
+    def restore_best(self, model):
+        """
+        把 best.pt 的权重装回 model，返回 (epoch, val_auc)；本次训练 (含恢复前) 没有记录过 val_auc 时不动 model，返回 None
+        """
+        if self.best_auc == -np.inf or not os.path.exists(self.best_path):
+            return None
+        state = load_checkpoint(self.best_path)
+        model.load_state_dict(state['model'])
+        return state['epoch'], state['best_val_auc']
+
+class ResumableEarlyStopping(EarlyStopping):
+    """
+    deepctr 的 EarlyStopping 在 on_train_begin 里会把 best / wait 清零，恢复训练时改为沿用断点里的值
+    """
+    def __init__(self, best=None, wait=0, **kwargs):
+        super().__init__(**kwargs)
+        self.resume_best, self.resume_wait = best, wait
+
+    def on_train_begin(self, logs=None):
+        super().on_train_begin(logs)
+        if self.resume_best is not None:
+            self.best, self.wait = self.resume_best, self.resume_wait
+
+class EpochCheckpoint(Callback):
+    """
+    model.fit 的回调: 每个 epoch 结束时保存断点，需放在 EarlyStopping 之后 (保存的是本 epoch 更新过的早停计数)
+    fit 在 on_epoch_end 之后、下一个 epoch 开始之前不再消耗随机数，所以这里记录的 RNG 状态就是下一个 epoch 的起点
+    另外 deepctr 的 fit 只在开头调用一次 train()，做过验证 (evaluate 里 eval()) 之后的 epoch 实际是在 eval 模式下训练的
+    (dropout 关闭)；断点里记下模块当时的模式，恢复时设为 training_mode，在 on_train_begin 里还原，保证逐位一致
+    """
+    def __init__(self, manager, early_stopping, epochs):
+        super().__init__()
+        self.manager = manager
+        self.early_stopping = early_stopping
+        self.epochs = epochs
+        self.history = {}  # 全部 epoch 的指标 (恢复训练时先填入断点里的历史)
+        self.training_mode = None  # 不为 None 时覆盖 fit 开头的 train()
+
+    def on_train_begin(self, logs=None):
+        if self.training_mode is not None:
+            self.model.train(self.training_mode)
+
+    def on_epoch_end(self, epoch, logs=None):
+        for name, value in (logs or {}).items():
+            self.history.setdefault(name, []).append(value)
+        self.manager.save(epoch + 1, self.model, self.model.optim, self.history, self.early_stopping.wait,
+                          rng_state(), stopped=self.model.stop_training, final=epoch + 1 >= self.epochs,
+                          extra={'training': self.model.training})
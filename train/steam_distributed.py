@@ -0,0 +1,153 @@
+import os
+import pickle
+import socket
+import tempfile
+import time
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+import torch.optim as optim
+from sklearn.metrics import log_loss, roc_auc_score
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DistributedSampler
+from steam_checkpoint import rng_state, set_rng_state
+from steam_profile import profiler
+
+# ==========================================
+# 🧮 单机多进程数据并行训练 (torch.distributed + gloo，纯 CPU)
+# 父进程编码好数据、建好模型后 fork 出 N 个 rank，输入张量靠写时复制共享，不重复解析 CSV；
+# 每个 epoch 所有 rank 用同一个种子打乱再各取 1/N (DistributedSampler)，每个 rank 的 batch 为 BATCH_SIZE，
+# 反向时 DDP 对梯度做 all-reduce 平均 (每个 rank 的 loss 都是 BATCH_SIZE 行的 BCE 求和 + 正则项，与单进程同口径)；
+# 验证集按 rank 切开各自预测，汇总到 rank 0 算 AUC，早停决定再广播给所有 rank；只有 rank 0 写权重和断点
+# (断点里存各 rank 自己的 RNG 状态，恢复时各自装回)；开启剖析时只在 rank 0 上记录，随历史指标一起交回父进程；
+# rank 0 的断点管理器是 fork 出的副本，它记下的最好 val_auc 也一并交回，父进程才能 restore_best
+# ==========================================
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def predict(model, X, batch_size):
+    model.eval()
+    with torch.no_grad():
+        return np.concatenate([model(X[b:b + batch_size]).squeeze(-1).numpy().astype("float64")
+                               for b in range(0, len(X), batch_size)] or [np.zeros(0)])
+
+def _train_rank(rank, world_size, port, model, X, y, config, history_path, checkpoints, resume):
+    # 每个 rank 分到 CPU 核数 / N 个 intra-op 线程，避免 N 个进程互相抢核
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    torch.manual_seed(config.SEED + rank)  # dropout 在各 rank 上取不同的 mask
+    dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{port}', rank=rank, world_size=world_size)
+    try:
+        if resume is not None:
+            model.load_state_dict(resume['model'])  # 在 DDP 包装 (广播 rank 0 的参数) 之前装回
+        ddp = DistributedDataParallel(model)
+        optimizer = optim.Adam(ddp.parameters(), lr=config.LEARNING_RATE)
+        if rank != 0: profiler.enabled = False
+        profiler.attach(model, optimizer)
+        # 验证集取最后 VALIDATION_SPLIT 的行，与 model.fit(validation_split=...) 一致
+        split_at = int(len(X) * (1. - config.VALIDATION_SPLIT))
+        sampler = DistributedSampler(range(split_at), num_replicas=world_size, rank=rank, shuffle=True, seed=config.SEED)
+        val_rows = torch.from_numpy(np.array_split(np.arange(split_at, len(X)), world_size)[rank])
+        if rank == 0:
+            print(f"Train on {split_at} samples, validate on {len(X) - split_at} samples, {world_size} processes (gloo)")
+
+        history = {}
+        best_auc, wait, start_epoch = -np.inf, 0, 0
+        if resume is not None:
+            optimizer.load_state_dict(resume['optimizer'])
+            history = {name: list(values) for name, values in resume['history'].items()}
+            best_auc, wait = resume['best_val_auc'], resume['wait']
+            start_epoch = config.EPOCHS if resume['stopped'] else resume['epoch']
+            set_rng_state(resume['rng'][rank])
+        for epoch in range(start_epoch, config.EPOCHS):
+            # 所有 rank 的行数相同 (DistributedSampler 会用开头的行补齐)，保证每步都能对上 all-reduce
+            sampler.set_epoch(epoch)
+            rows = torch.tensor(list(sampler))
+            profiler.epoch_begin(epoch)
+            model.train()
+            t0 = time.perf_counter()
+            loss_sum = 0.0
+            for b in range(0, len(rows), config.BATCH_SIZE):
+                idx = rows[b:b + config.BATCH_SIZE]
+                y_pred = ddp(X[idx]).squeeze(-1)
+                loss = F.binary_cross_entropy(y_pred, y[idx], reduction='sum')
+                total_loss = loss + model.get_regularization_loss() + model.aux_loss
+                optimizer.zero_grad()
+                total_loss.backward()
+                optimizer.step()
+                loss_sum += total_loss.item()
+            train_seconds = time.perf_counter() - t0
+
+            stats = torch.tensor([loss_sum, len(rows)], dtype=torch.float64)
+            dist.all_reduce(stats)
+            slowest = torch.tensor([train_seconds], dtype=torch.float64)
+            dist.all_reduce(slowest, op=dist.ReduceOp.MAX)
+            preds = predict(model, X[val_rows], config.EVAL_BATCH_SIZE)
+            gathered = [None] * world_size if rank == 0 else None
+            dist.gather_object(preds, gathered, dst=0)
+            # 本 epoch 之后不再消耗随机数，此时的状态就是下一个 epoch 的起点
+            rng = [None] * world_size if rank == 0 else None
+            dist.gather_object(rng_state(), rng, dst=0)
+
+            stop = [False]
+            if rank == 0:
+                logs = {'loss': stats[0].item() / stats[1].item()}
+                if len(X) > split_at:
+                    preds, labels = np.concatenate(gathered), y[split_at:].numpy()
+                    logs['val_binary_crossentropy'], logs['val_auc'] = log_loss(labels, preds), roc_auc_score(labels, preds)
+                logs['samples_per_sec'] = split_at / slowest.item()
+                profiler.epoch_end(stats[1].item())
+                for name, value in logs.items():
+                    history.setdefault(name, []).append(value)
+                print(f"Epoch {epoch + 1}/{config.EPOCHS}\n{int(slowest.item())}s - "
+                      + " - ".join(f"{name}: {value:.4f}" for name, value in logs.items()))
+                if 'val_auc' in logs:
+                    if logs['val_auc'] > best_auc:
+                        best_auc, wait = logs['val_auc'], 0
+                    else:
+                        wait += 1
+                        stop[0] = wait >= config.PATIENCE
+                if checkpoints is not None:
+                    checkpoints.save(epoch + 1, model, optimizer, history, wait, rng,
+                                     stopped=stop[0], final=epoch + 1 >= config.EPOCHS)
+                if stop[0]:
+                    print(f"Epoch {epoch + 1:05d}: early stopping")
+            dist.broadcast_object_list(stop, src=0)
+            if stop[0]: break
+
+        if rank == 0:
+            torch.save(model.state_dict(), config.MODEL_PATH)
+            profiler.finish()
+            with open(history_path, 'wb') as f:
+                best = checkpoints.best_auc if checkpoints is not None else None
+                pickle.dump((history, profiler.epochs, profiler.trace, best), f)
+        dist.barrier()
+    finally:
+        dist.destroy_process_group()
+
+def fit_distributed(model, X, y, config, world_size, checkpoints=None, resume=None):
+    """
+    用 world_size 个进程数据并行训练 model (X: 按 model.feature_index 拼好的 (N, D) float32 张量，y: 标签)
+    训练完 rank 0 把权重写到 config.MODEL_PATH，这里再加载回 model；返回 rank 0 记录的各 epoch 指标
+    checkpoints / resume 同 steam_train.fit_stream (断点必须来自同样的进程数)
+    """
+    fd, history_path = tempfile.mkstemp(suffix='.pkl')
+    os.close(fd)
+    try:
+        # fork: 子进程直接继承模型和输入张量，不需要 pickle 传参
+        mp.start_processes(_train_rank, args=(world_size, free_port(), model, X, y, config, history_path, checkpoints, resume),
+                           nprocs=world_size, join=True, start_method='fork')
+        with open(history_path, 'rb') as f:
+            history, epochs, trace, best_auc = pickle.load(f)
+        if checkpoints is not None:
+            checkpoints.best_auc = best_auc
+        if profiler.enabled:
+            profiler.epochs, profiler.trace = epochs, trace
+    finally:
+        os.remove(history_path)
+    model.load_state_dict(torch.load(config.MODEL_PATH, map_location='cpu'))
+    return history
@@ -0,0 +1,173 @@
+import argparse
+import copy
+import io
+import json
+import time
+import warnings
+import numpy as np
+import torch
+import torch.nn as nn
+from sklearn.metrics import roc_auc_score
+from deepctr_torch.models import DeepFM
+from steam_features import (artifacts_path_for, build_feature_columns, build_input_tensor,
+                            encode_interactions, load_artifacts, read_interactions, save_inference_module)
+
+# ==========================================
+# ⚙️ 配置中心: 把训练好的 DeepFM 导出成 CPU 推理用的 TorchScript 图
+# 用法: python steam_export.py --quantize --emb-dtype fp16 --report
+# ==========================================
+class ExportConfig:
+    CSV_PATH = '../data/steam/deepfm_train_100k.csv'  # 只用来算 AUC: 最后 20% 与训练时的验证集一致
+    MODEL_PATH = 'deepfm_steam_weights.pth'
+    ARTIFACTS_PATH = artifacts_path_for(MODEL_PATH)
+    EXPORT_PATH = 'deepfm_steam_infer.pt'
+    REPORT_PATH = 'export_report.json'
+    VALIDATION_SPLIT = 0.2
+    LATENCY_ROWS = 100_000
+    BATCH_SIZE = 4096
+
+cfg = ExportConfig()
+
+EMB_DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+def load_eager_model(bundle, weights_path):
+    cols = build_feature_columns(bundle['feature_spec'])
+    spec = bundle['model_spec']
+    model = DeepFM(linear_feature_columns=cols, dnn_feature_columns=cols, task='binary',
+                   dnn_hidden_units=spec['dnn_hidden_units'], dnn_dropout=spec['dnn_dropout'], device='cpu')
+    model.load_state_dict(torch.load(weights_path, map_location='cpu'))
+    return model.eval()
+
+def _cast_embedding_output(module, inputs, output):
+    # 低精度只用来存表，查出来立刻转回 float32，后面的池化/FM/DNN 都不用改
+    return output.float()
+
+def optimize_model(model, quantize=False, emb_dtype='fp32'):
+    """
+    返回一个优化后的副本:
+      * emb_dtype=fp16/bf16: 所有 Embedding 表 (含 linear 部分) 以低精度存储
+      * quantize=True: DNN 的 Linear 层做动态 int8 量化
+    """
+    model = copy.deepcopy(model).eval()
+    if emb_dtype != 'fp32':
+        for module in model.modules():
+            if isinstance(module, nn.Embedding):
+                module.weight.data = module.weight.data.to(EMB_DTYPES[emb_dtype])
+                module.register_forward_hook(_cast_embedding_output)
+    if quantize:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # torch.ao 量化接口的弃用提示
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    return model
+
+def trace_model(model, example):
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return torch.jit.trace(model, example, check_trace=False)
+
+def predict(model, X, batch_size=cfg.BATCH_SIZE):
+    with torch.no_grad():
+        return torch.cat([model(X[i:i + batch_size]) for i in range(0, len(X), batch_size)]).squeeze(1).numpy()
+
+def measure_latency(model, X, repeat=5):
+    """
+    返回给 X 全部打分的中位数耗时 (ms)
+    """
+    for _ in range(3):  # 预热: TorchScript 的 profiling executor 前几次调用会重新优化图
+        predict(model, X[:cfg.BATCH_SIZE])
+    costs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        predict(model, X)
+        costs.append((time.perf_counter() - t0) * 1000)
+    return float(np.median(costs))
+
+def build_eval_inputs(bundle, feature_index, csv_path):
+    """
+    验证集 (CSV 最后 VALIDATION_SPLIT 部分，和 model.fit 的 validation_split 一致) 以及
+    一份平铺 Item 表得到的 LATENCY_ROWS 行打分输入
+    """
+    data = read_interactions(csv_path)
+    data = data.iloc[int(len(data) * (1 - cfg.VALIDATION_SPLIT)):]
+    feats, labels = encode_interactions(data, bundle)
+    X_val = build_input_tensor(feature_index, feats, len(data))
+
+    table = bundle['item_table']
+    rows = np.arange(cfg.LATENCY_ROWS) % len(table['item_id_idx'])
+    rng = np.random.default_rng(2025)
+    item_feats = {
+        'item_id_idx': table['item_id_idx'][rows],
+        'user_type_idx': rng.integers(0, bundle['feature_spec']['user_type_idx'], cfg.LATENCY_ROWS),
+        'price_norm': table['price_norm'][rows],
+        'tags': table['tags'][rows],
+    }
+    X_items = build_input_tensor(feature_index, item_feats, cfg.LATENCY_ROWS)
+    return X_val, labels, X_items
+
+def serialized_size(module):
+    buf = io.BytesIO()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        torch.jit.save(module, buf)
+    return buf.getbuffer().nbytes
+
+def accuracy_latency_report(eager, X_val, labels, X_items):
+    """
+    对比各导出模式的 AUC 和每 10 万个 Item 的打分耗时
+    """
+    modes = [
+        ('eager-fp32', False, 'fp32', False),
+        ('traced-fp32', False, 'fp32', True),
+        ('traced-int8', True, 'fp32', True),
+        ('traced-fp16emb', False, 'fp16', True),
+        ('traced-bf16emb', False, 'bf16', True),
+        ('traced-int8-fp16emb', True, 'fp16', True),
+    ]
+    base_scores = predict(eager, X_val)
+    base_auc = roc_auc_score(labels, base_scores)
+    scale = 100_000 / len(X_items)
+    report = []
+    for name, quantize, emb_dtype, traced in modes:
+        model = optimize_model(eager, quantize, emb_dtype)
+        if traced:
+            model = trace_model(model, X_items[:cfg.BATCH_SIZE])
+        scores = predict(model, X_val)
+        auc = roc_auc_score(labels, scores)
+        row = {
+            'mode': name,
+            'auc': round(float(auc), 6),
+            'auc_delta': round(float(auc - base_auc), 6),
+            'max_abs_score_diff': round(float(np.abs(scores - base_scores).max()), 6),
+            'ms_per_100k_items': round(measure_latency(model, X_items) * scale, 3),
+            'size_bytes': serialized_size(model) if traced else None,
+        }
+        report.append(row)
+        print(f"   {name:<20} AUC={row['auc']:.4f} (Δ {row['auc_delta']:+.4f})  "
+              f"{row['ms_per_100k_items']:>8.2f} ms/100k  max|Δscore|={row['max_abs_score_diff']:.4f}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出 DeepFM 的 CPU 推理图")
+    parser.add_argument("--quantize", action="store_true", help="DNN Linear 层动态 int8 量化")
+    parser.add_argument("--emb-dtype", choices=list(EMB_DTYPES), default="fp32", help="Embedding 表的存储精度")
+    parser.add_argument("--report", action="store_true", help="在验证集上对比所有模式的 AUC 与耗时")
+    parser.add_argument("--csv", default=cfg.CSV_PATH)
+    args = parser.parse_args()
+
+    bundle = load_artifacts(cfg.ARTIFACTS_PATH, cfg.MODEL_PATH)
+    eager = load_eager_model(bundle, cfg.MODEL_PATH)
+    print(f"🔧 已加载 {cfg.MODEL_PATH}，读取评估数据 {args.csv} ...")
+    X_val, labels, X_items = build_eval_inputs(bundle, eager.feature_index, args.csv)
+
+    if args.report:
+        print(f"📏 精度/耗时对比 (验证集 {len(X_val)} 行, torch 线程数 {torch.get_num_threads()}):")
+        report = accuracy_latency_report(eager, X_val, labels, X_items)
+        with open(cfg.REPORT_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'num_threads': torch.get_num_threads(), 'validation_rows': len(X_val), 'modes': report},
+                      f, ensure_ascii=False, indent=2)
+        print(f"📊 报告已保存: {cfg.REPORT_PATH}")
+
+    traced = trace_model(optimize_model(eager, args.quantize, args.emb_dtype), X_items[:cfg.BATCH_SIZE])
+    save_inference_module(traced, cfg.EXPORT_PATH, cfg.MODEL_PATH,
+                          {'quantize': args.quantize, 'emb_dtype': args.emb_dtype})
+    print(f"✅ 推理图已导出: {cfg.EXPORT_PATH} (quantize={args.quantize}, emb_dtype={args.emb_dtype})")
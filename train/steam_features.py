@@ -0,0 +1,281 @@
+import ast
+import hashlib
+import json
+import os
+import pickle
+import warnings
+import numpy as np
+import pandas as pd
+import torch
+from deepctr_torch.inputs import SparseFeat, DenseFeat, VarLenSparseFeat
+
+# ==========================================
+# 📦 训练端 / 服务端共享的特征定义与预处理产物 (artifacts)
+# steam_train 训练完把编码器、归一化参数、特征规格和 Item 表存成一个 bundle，
+# steam_service 直接从 bundle 冷启动，不再重读 CSV、重新 fit 编码器
+# ==========================================
+ARTIFACT_VERSION = 1
+# 交互数据里属于游戏本身的列；规范化格式下它们只在 Item 表里存一份
+ITEM_FIELDS = ['title', 'price', 'tags_list', 'tag_names', 'cover_url']
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def artifacts_path_for(model_path):
+    """
+    bundle 和权重放在一起: deepfm_steam_weights.pth -> deepfm_steam_artifacts.pkl
+    """
+    root, _ = os.path.splitext(model_path)
+    if root.endswith('_weights'):
+        root = root[:-len('_weights')]
+    return f"{root}_artifacts.pkl"
+
+def items_path_for(csv_path):
+    """
+    规范化格式的 Item 表和交互表放在一起: deepfm_train_100k.csv -> deepfm_train_100k_items.csv
+    """
+    root, ext = os.path.splitext(csv_path)
+    return f"{root}_items{ext}"
+
+def read_items(csv_path):
+    """
+    csv_path 是规范化格式 (只有 user_id / user_type / item_id / label，没有 tags_list) 时读入旁边的 Item 表，
+    宽表 (每行自带游戏信息) 时返回 None
+    """
+    if 'tags_list' in pd.read_csv(csv_path, nrows=0).columns:
+        return None
+    items = pd.read_csv(items_path_for(csv_path))
+    if items['item_id'].duplicated().any():
+        raise ValueError(f"{items_path_for(csv_path)} 里有重复的 item_id")
+    return items
+
+def join_items(data, items, columns=ITEM_FIELDS):
+    """
+    规范化格式 -> 宽表: 按 item_id 把 Item 表的 columns 接到每条交互上
+    返回 (宽表, 每行在 Item 表里的行号, 只保留被交互引用到的游戏的 Item 表)
+    字符串列按行号 take，同一个游戏的字符串在各行之间共享同一个对象，不会逐行复制
+    """
+    idx = pd.Index(items['item_id']).get_indexer(data['item_id'])
+    if (idx < 0).any():
+        raise ValueError(f"{(idx < 0).sum()} 条交互的 item_id 不在 Item 表里")
+    used, rows = np.unique(idx, return_inverse=True)
+    items = items.iloc[used].reset_index(drop=True)
+    return data.assign(**{col: items[col].to_numpy()[rows] for col in columns}), rows, items
+
+def read_interactions(csv_path):
+    """
+    读一份交互数据，宽表和规范化格式 (交互表 + Item 表) 都返回同样列的宽表 DataFrame
+    """
+    data = pd.read_csv(csv_path)
+    items = read_items(csv_path)
+    return data if items is None else join_items(data, items)[0]
+
+def build_feature_columns(spec):
+    """
+    按特征规格构造 DeepFM 的特征列，训练和服务共用，保证两边结构一致
+    """
+    fixlen_feature_columns = [
+        SparseFeat('item_id_idx', vocabulary_size=spec['item_id_idx'], embedding_dim=spec['embedding_dim']),
+        SparseFeat('user_type_idx', vocabulary_size=spec['user_type_idx'], embedding_dim=spec['embedding_dim']),
+        DenseFeat('price_norm', dimension=1)
+    ]
+    varlen_feature_columns = [
+        VarLenSparseFeat(
+            SparseFeat('tags', vocabulary_size=spec['tags'], embedding_dim=spec['embedding_dim']),
+            maxlen=spec['max_tag_len'], combiner='mean', length_name=None
+        )
+    ]
+    return fixlen_feature_columns + varlen_feature_columns
+
+def parse_tag_lists(values):
+    """
+    批量解析 tags_list 列 ("[4172, 122, 1695]" 这种 JSON 风格的非负整数列表)
+    返回 (所有行拼接起来的 tag 数组, 每行的 tag 个数)
+    整列拼成一段字节后用 numpy 一次找出所有数字并按位累加，不再逐行 ast.literal_eval；
+    格式不是纯整数列表 (例如字符串 tag、负数、已经是 list、缺失值) 时退回逐行解析，结果相同
+    """
+    values = values.tolist() if hasattr(values, 'tolist') else list(values)
+    fast = _parse_int_lists(values) if all(type(x) is str for x in values) else None
+    if fast is not None:
+        return fast
+    seqs = [ast.literal_eval(x) if isinstance(x, str) else list(x) for x in values]
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    return np.array([tag for seq in seqs for tag in seq]), lengths
+
+def _parse_int_lists(values):
+    # 每行必须恰好是 "[数字, 数字, ...]" (只允许空格作分隔)，否则返回 None 交给 ast
+    if not values: return None
+    try:
+        buf = np.frombuffer(''.join(values).encode('ascii'), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return None
+    sizes = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    row_end = np.cumsum(sizes)
+    row_start = row_end - sizes
+    digit = (buf >= ord('0')) & (buf <= ord('9'))
+    opens, closes, commas = buf == ord('['), buf == ord(']'), buf == ord(',')
+    if not (digit | opens | closes | commas | (buf == ord(' '))).all(): return None
+    if (sizes < 2).any() or not (opens[row_start].all() and closes[row_end - 1].all()): return None
+    if opens.sum() != len(values) or closes.sum() != len(values): return None
+
+    num_start = digit & ~np.concatenate([[False], digit[:-1]])
+    num_end = digit & ~np.concatenate([digit[1:], [False]])
+    # 行内的 token (数字 / 逗号) 必须是 数字, 逗号, 数字, ... 数字 交替出现
+    tokens = np.flatnonzero(num_start | commas)
+    is_comma = commas[tokens]
+    new_row = np.ones(len(tokens), dtype=bool)
+    token_row = np.searchsorted(row_start, tokens, side='right')
+    new_row[1:] = token_row[1:] != token_row[:-1]
+    last_in_row = np.append(new_row[1:], True)
+    if (is_comma & (new_row | last_in_row)).any(): return None
+    if (~new_row[1:] & (is_comma[1:] == is_comma[:-1])).any(): return None
+
+    first, last = np.flatnonzero(num_start), np.flatnonzero(num_end)
+    width = last - first + 1
+    # 超出 int64 的大数和 ast 不接受的前导零 (如 "007") 也交给 ast
+    if (width > 18).any() or ((width > 1) & (buf[first] == ord('0'))).any(): return None
+    lengths = np.bincount(token_row[~is_comma] - 1, minlength=len(values)).astype(np.int64)
+    if not len(first):
+        return np.zeros(0, dtype=np.int64), lengths
+    # 每一位乘上 10 的 (所在数字最后一位的位置 - 当前位置) 次方，再按数字求和
+    pos = np.flatnonzero(digit)
+    power = np.repeat(last, width) - pos
+    flat = np.add.reduceat((buf[pos] - ord('0')).astype(np.int64) * 10 ** power, np.cumsum(width) - width)
+    return flat, lengths
+
+def encode_tag_matrix(values, classes, max_len, dtype=np.int64):
+    """
+    tags_list 列 -> 补齐/截断到 max_len 的 (N, max_len) id 矩阵
+    id = tag 在 classes (排好序的 LabelEncoder.classes_) 中的下标 + 1，0 留给 padding 和不认识的 tag
+    一次 get_indexer 查完所有 tag，与逐行 transform + pad_sequences 结果一致
+    """
+    flat, lengths = parse_tag_lists(values)
+    ids = pd.Index(classes).get_indexer(flat) + 1  # 不认识的是 -1 + 1 = 0
+    return pad_tag_ids(ids, lengths, max_len, dtype)
+
+def pad_tag_ids(ids, lengths, max_len, dtype=np.int64):
+    """
+    把拼接在一起的 id 按 (行, 行内位置) 直接写进 (N, max_len) 的补齐矩阵，超出 max_len 的截断
+    """
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    pos = np.arange(len(ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    keep = pos < max_len
+    tags = np.zeros((len(lengths), max_len), dtype=dtype)
+    tags[rows[keep], pos[keep]] = ids[keep]
+    return tags
+
+def build_input_tensor(feature_index, feats, num_rows):
+    """
+    按 feature_index 的列顺序把各特征拼成 DeepCTR forward 需要的 (N, D) float32 连续张量
+    """
+    X = torch.cat([torch.tensor(np.asarray(feats[name])).reshape(num_rows, -1).float()
+                   for name in feature_index], dim=1)
+    return X.contiguous()
+
+def encode_interactions(data, bundle):
+    """
+    用 bundle 里已经 fit 好的编码器和归一化参数编码一份交互数据 (不重新 fit)
+    不认识的 tag 编码为 0 (即 padding)，不认识的 item / user_type 直接报错
+    """
+    encoders = bundle['encoders']
+    spec = bundle['feature_spec']
+    
+    def lookup(name, values):
+        idx = pd.Index(encoders[name]).get_indexer(values)
+        if (idx < 0).any():
+            raise ValueError(f"{name} 中有 {(idx < 0).sum()} 个值不在 artifacts 的词表里")
+        return idx.astype(np.int64)
+    
+    tags = encode_tag_matrix(data['tags_list'], encoders['tags'], spec['max_tag_len'])
+    
+    scaler = bundle['scaler']
+    lo, hi = scaler['feature_range']
+    # 与 MinMaxScaler.transform 相同的计算顺序: X * scale_ + min_
+    scale = (hi - lo) / ((scaler['data_max'] - scaler['data_min']) or 1.0)
+    price_norm = data['price'].to_numpy(dtype=np.float64) * scale + (lo - scaler['data_min'] * scale)
+    
+    feats = {
+        'item_id_idx': lookup('item_id', data['item_id'].to_numpy()),
+        'user_type_idx': lookup('user_type', data['user_type'].to_numpy()),
+        'price_norm': price_norm,
+        'tags': tags,
+    }
+    return feats, data['label'].to_numpy() if 'label' in data else None
+
+def build_item_table(data, tags_padded):
+    """
+    从交互日志里抽出每个游戏一行的 Item 表 (列数组 + 补齐后的 tags 矩阵)
+    """
+    first = ~data['item_id'].duplicated().to_numpy()
+    table = {col: data[col].to_numpy()[first] for col in
+             ['item_id', 'title', 'cover_url', 'tag_names', 'item_id_idx', 'price_norm']}
+    table['tags'] = np.ascontiguousarray(tags_padded[first])
+    return table
+
+def scaler_params(scaler):
+    """
+    MinMaxScaler -> 可序列化的参数 dict (encode_interactions 用的就是这个格式)，已经是参数 dict 时原样返回
+    """
+    if isinstance(scaler, dict): return dict(scaler)
+    return {'data_min': float(scaler.data_min_[0]), 'data_max': float(scaler.data_max_[0]),
+            'feature_range': tuple(scaler.feature_range)}
+
+def save_artifacts(path, encoders, scaler, feature_spec, model_spec, item_table, weights_path):
+    """
+    保存 bundle，并记录对应权重文件的 sha256，服务端据此拒绝不匹配的组合
+    """
+    bundle = {
+        'version': ARTIFACT_VERSION,
+        'weights_sha256': file_sha256(weights_path),
+        'encoders': {name: np.asarray(classes) for name, classes in encoders.items()},
+        'scaler': scaler_params(scaler),
+        'feature_spec': dict(feature_spec),
+        'model_spec': dict(model_spec),
+        'item_table': item_table,
+    }
+    with open(path, 'wb') as f:
+        pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return bundle
+
+def load_artifacts(path, weights_path):
+    """
+    读取 bundle；版本不对或与权重文件不匹配时抛 ValueError
+    """
+    with open(path, 'rb') as f:
+        bundle = pickle.load(f)
+    if bundle.get('version') != ARTIFACT_VERSION:
+        raise ValueError(f"artifact 版本不匹配: {bundle.get('version')} != {ARTIFACT_VERSION}，请重新运行 steam_train.py")
+    weights_sha = file_sha256(weights_path)
+    if bundle['weights_sha256'] != weights_sha:
+        raise ValueError(f"artifact 与权重不匹配: {path} 对应 {bundle['weights_sha256'][:12]}，"
+                         f"而 {weights_path} 是 {weights_sha[:12]}")
+    return bundle
+
+def save_inference_module(module, path, weights_path, meta):
+    """
+    保存导出的推理图 (TorchScript)，在附加文件里记录来源权重的 sha256 和导出模式
+    """
+    meta = dict(meta, weights_sha256=file_sha256(weights_path), version=ARTIFACT_VERSION)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # 新版 torch 对 TorchScript 的弃用提示
+        torch.jit.save(module, path, _extra_files={'meta.json': json.dumps(meta)})
+    return meta
+
+def load_inference_module(path, weights_path, map_location='cpu'):
+    """
+    加载导出的推理图；与当前权重不是同一次训练产出时抛 ValueError
+    """
+    extra = {'meta.json': ''}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        module = torch.jit.load(path, map_location=map_location, _extra_files=extra)
+    meta = json.loads(extra['meta.json'] or '{}')
+    weights_sha = file_sha256(weights_path)
+    if meta.get('weights_sha256') != weights_sha:
+        raise ValueError(f"推理图与权重不匹配: {path} 导出自 {str(meta.get('weights_sha256'))[:12]}，"
+                         f"而 {weights_path} 是 {weights_sha[:12]}，请重新运行 steam_export.py")
+    return module, meta
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from steam_features import parse_tag_lists
+
+# ==========================================
+# 🌱 热启动增量训练: 在上一版模型和 artifacts 的基础上接着训
+# 旧的 id 映射保持不变 (item / tag 的下标不动)，新爬到的游戏和 tag 排好序追加在词表末尾，
+# 对应的 embedding 表按行扩容: 旧行拷贝上一版的权重，新行保留模型初始化的随机值；
+# 价格归一化沿用旧参数，保证已学到的权重含义不变
+# ==========================================
+
+def extend_classes(classes, values):
+    """
+    在 classes 末尾追加 values 里没见过的值 (排好序)，返回 (新 classes, 新增个数)
+    """
+    classes = np.asarray(classes)
+    new = np.setdiff1d(pd.unique(np.asarray(values)), classes)
+    return np.concatenate([classes, new.astype(classes.dtype)]), len(new)
+
+def extend_encoders(encoders, data):
+    """
+    用新数据扩充 artifacts 里的编码器: item_id 和 tag 只追加不重排
+    user_type 是模型的输入类别而不是内容，出现新类型时需要全量重训，这里直接报错
+    返回 (新 encoders, {名字: 新增个数})
+    """
+    unknown = np.setdiff1d(data['user_type'].unique(), encoders['user_type'])
+    if len(unknown):
+        raise ValueError(f"新数据里有未知的玩家类型 {list(unknown)}，无法热启动，请全量训练")
+    item_ids, new_items = extend_classes(encoders['item_id'], data['item_id'].to_numpy())
+    tags, new_tags = extend_classes(encoders['tags'], parse_tag_lists(data['tags_list'])[0])
+    extended = dict(encoders, item_id=item_ids, tags=tags)
+    return extended, {'item_id': new_items, 'tags': new_tags}
+
+def merge_item_table(old, new):
+    """
+    合并 Item 表: 新数据里出现的游戏用新的一行 (标题 / 价格可能变了)，只在旧表里的游戏保留原样
+    """
+    keep = ~np.isin(old['item_id'], new['item_id'])
+    return {col: np.concatenate([np.asarray(old[col])[keep], np.asarray(new[col]).astype(np.asarray(old[col]).dtype)])
+            for col in old}
+
+def grow_state_dict(old_state, model):
+    """
+    把上一版的权重装进 (词表变大了的) 新模型: 形状相同的参数直接拷贝，
+    第 0 维变长的 (embedding 表) 拷贝前面的旧行，其余行保留 model 当前的初始化值
+    返回可以直接 model.load_state_dict 的 state dict
+    """
+    state = model.state_dict()
+    for name, value in state.items():
+        if name not in old_state:
+            raise ValueError(f"上一版权重里没有 {name}，模型结构不一致")
+        old = old_state[name]
+        if old.shape == value.shape:
+            state[name] = old
+        elif old.dim() == value.dim() and old.shape[1:] == value.shape[1:] and old.shape[0] < value.shape[0]:
+            grown = value.clone()
+            grown[:old.shape[0]] = old
+            state[name] = grown
+        else:
+            raise ValueError(f"{name} 的形状 {tuple(old.shape)} 无法扩容到 {tuple(value.shape)}")
+    return state
@@ -0,0 +1,229 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+from steam_benchmark import write_synthetic_model
+from steam_features import artifacts_path_for, load_artifacts
+
+# ==========================================
+# 🏋️ /recommend 本地压测: 合成模型 + 合成目录，只在 127.0.0.1 上跑，不开 ngrok、不访问外网
+# 用法: python steam_loadtest.py --items 100000 --concurrency 1 8 32 --duration 10 -- --no-score-table --micro-batch
+#       "--" 之后的参数原样传给 steam_service.py
+# ==========================================
+class LoadTestConfig:
+    HOST = '127.0.0.1'
+    REPORT_PATH = 'loadtest_report.json'
+    STARTUP_TIMEOUT = 600  # 百万级目录建表可能要几分钟
+    TOP_K = [3, 10, 50]
+    RSS_SAMPLE_SECONDS = 0.2
+    SEED = 2025
+
+cfg = LoadTestConfig()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((cfg.HOST, 0))
+        return sock.getsockname()[1]
+
+def process_tree(pid):
+    """
+    pid 及其所有子孙进程 (prefork 模式下的 worker)，通过 /proc/*/stat 的 ppid 找
+    """
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit(): continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # comm 字段可能含空格，从最后一个 ')' 之后开始解析
+                fields = f.read().rsplit(')', 1)[1].split()
+            parents.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError):
+            continue
+    tree, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        tree.append(p)
+        todo.extend(parents.get(p, []))
+    return tree
+
+def read_status_kb(pid, key):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+class RssSampler:
+    """
+    后台线程定期采样服务进程树的 RSS；reset() 开始一个新的统计窗口
+    多进程模式下各 worker 的 RSS 里有共享页，求和会重复计算，所以同时报告单进程最大值
+    """
+    def __init__(self, pid, interval):
+        self.pid = pid
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.reset()
+        self.worker = threading.Thread(target=self._loop, daemon=True)
+        self.worker.start()
+
+    def reset(self):
+        with self.lock:
+            self.peak_total_kb = self.peak_process_kb = 0
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            rss = [read_status_kb(p, 'VmRSS') for p in process_tree(self.pid)]
+            with self.lock:
+                self.peak_total_kb = max(self.peak_total_kb, sum(rss))
+                self.peak_process_kb = max(self.peak_process_kb, max(rss, default=0))
+
+    def snapshot(self):
+        with self.lock:
+            return {'peak_rss_mb': round(self.peak_process_kb / 1024, 1),
+                    'peak_rss_total_mb': round(self.peak_total_kb / 1024, 1)}
+
+def log_tail(log_path, lines=20):
+    # 临时目录在退出时会被删掉，报错时把日志尾部带出来
+    with open(log_path, encoding='utf-8', errors='replace') as f:
+        return ''.join(f.readlines()[-lines:])
+
+def start_service(weights_path, port, service_args, log_path):
+    cmd = [sys.executable, 'steam_service.py', '--port', str(port), '--model', weights_path, '--no-ngrok', *service_args]
+    # 子进程拿到的是 dup 出来的文件描述符，父进程这边的句柄 Popen 之后就可以关掉
+    with open(log_path, 'w') as log:
+        proc = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + cfg.STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务启动失败 (exit={proc.returncode}):\n{log_tail(log_path)}")
+        try:
+            conn = http.client.HTTPConnection(cfg.HOST, port, timeout=1)
+            conn.request('GET', '/metrics')
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError(f"服务在 {cfg.STARTUP_TIMEOUT}s 内没有就绪:\n{log_tail(log_path)}")
+
+def synthetic_types(weights_path):
+    bundle = load_artifacts(artifacts_path_for(weights_path), weights_path)
+    return [str(t) for t in bundle['encoders']['user_type']]
+
+def run_level(port, concurrency, duration, warmup, queries):
+    """
+    concurrency 个线程循环发请求，每个线程按自己的随机序列从 queries 里取 (type, top_k)
+    预热 warmup 秒后开始计时统计，持续 duration 秒
+    """
+    start = time.perf_counter()
+    measure_from, stop_at = start + warmup, start + warmup + duration
+    results = [[] for _ in range(concurrency)]  # 每个线程各写各的列表，不需要加锁
+
+    def client(rank):
+        rng = np.random.default_rng(cfg.SEED + rank)
+        out = results[rank]
+        while True:
+            body = json.dumps(queries[rng.integers(len(queries))])
+            t0 = time.perf_counter()
+            if t0 >= stop_at: break
+            try:
+                conn = http.client.HTTPConnection(cfg.HOST, port, timeout=60)
+                conn.request('POST', '/recommend', body=body, headers={'Content-Type': 'application/json'})
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status == 200
+                conn.close()
+            except OSError:
+                ok = False
+            t1 = time.perf_counter()
+            if t0 >= measure_from:
+                out.append((t1 - t0, ok))
+
+    threads = [threading.Thread(target=client, args=(r,)) for r in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = max(time.perf_counter(), stop_at) - measure_from
+
+    samples = [s for per_thread in results for s in per_thread]
+    latency = np.array([cost for cost, ok in samples if ok]) * 1000
+    errors = sum(1 for _, ok in samples if not ok)
+    pct = (lambda q: round(float(np.percentile(latency, q)), 3)) if len(latency) else (lambda q: None)
+    return {
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': errors,
+        'qps': round(len(latency) / elapsed, 2),
+        'latency_ms': {'mean': round(float(latency.mean()), 3) if len(latency) else None,
+                       'p50': pct(50), 'p95': pct(95), 'p99': pct(99),
+                       'max': round(float(latency.max()), 3) if len(latency) else None},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="steam_service 本地压测")
+    parser.add_argument("--items", type=int, default=10_000, help="合成目录的游戏数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="每个并发档位的统计时长 (秒)")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--top-k", type=int, nargs="+", default=cfg.TOP_K)
+    parser.add_argument("--types", nargs="+", default=None, help="参与压测的玩家类型，默认服务支持的全部类型")
+    parser.add_argument("--output", default=cfg.REPORT_PATH)
+    parser.add_argument("service_args", nargs=argparse.REMAINDER, help="'--' 之后的参数原样传给 steam_service.py")
+    args = parser.parse_args()
+    service_args = args.service_args[1:] if args.service_args[:1] == ['--'] else args.service_args
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"🧪 生成合成模型与目录: {args.items} 个游戏 ...")
+        weights_path = write_synthetic_model(tmp, args.items)
+        port = free_port()
+        log_path = os.path.join(tmp, 'service.log')
+        t0 = time.perf_counter()
+        proc = start_service(weights_path, port, service_args, log_path)
+        startup = time.perf_counter() - t0
+        print(f"🚀 服务就绪: http://{cfg.HOST}:{port} (启动 {startup:.1f}s, 参数 {service_args})")
+        try:
+            types = args.types or synthetic_types(weights_path)
+            queries = [{'type': t, 'top_k': k} for t in types for k in args.top_k]
+            sampler = RssSampler(proc.pid, cfg.RSS_SAMPLE_SECONDS)
+            levels = []
+            print(f"{'conc':>5} | {'qps':>9} | {'p50(ms)':>8} | {'p95(ms)':>8} | {'p99(ms)':>8} | {'errors':>6} | {'peak RSS(MB)':>12}")
+            for concurrency in args.concurrency:
+                sampler.reset()
+                level = run_level(port, concurrency, args.duration, args.warmup, queries)
+                level.update(sampler.snapshot())
+                levels.append(level)
+                lat = level['latency_ms']
+                print(f"{concurrency:>5} | {level['qps']:>9.1f} | {lat['p50'] or 0:>8.2f} | {lat['p95'] or 0:>8.2f} | "
+                      f"{lat['p99'] or 0:>8.2f} | {level['errors']:>6} | {level['peak_rss_mb']:>12.1f}")
+            sampler.stopped.set()
+            # 内核记录的整个运行期间的峰值 (VmHWM)，包括启动时建表的开销
+            hwm = {pid: read_status_kb(pid, 'VmHWM') for pid in process_tree(proc.pid)}
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'items': args.items, 'duration_s': args.duration, 'warmup_s': args.warmup,
+                   'top_k': args.top_k, 'types': types, 'service_args': service_args, 'cpu_count': os.cpu_count()},
+        'startup_s': round(startup, 2),
+        'peak_rss_hwm_mb': {str(pid): round(kb / 1024, 1) for pid, kb in hwm.items()},
+        'levels': levels,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📊 报告已保存: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import bisect
+import os
+import threading
+import time
+
+# ==========================================
+# 📈 进程内指标: 计数器 / Gauge / 直方图，按 Prometheus 文本格式 (0.0.4) 输出
+# 不依赖 prometheus_client，多进程模式下每个 worker 各自一份，输出时带上 pid 标签
+# ==========================================
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 单位: 秒，覆盖 50µs ~ 10s
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labels):
+    if not labels: return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一格是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """
+    线程安全的指标表: 每个指标名下按标签组合 (有序元组) 存一份值
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}  # name -> (type, help)
+        self.values = {}  # name -> {labels: value 或 Histogram}
+
+    def _series(self, name, kind, help_text):
+        if name not in self.meta:
+            self.meta[name] = (kind, help_text)
+            self.values[name] = {}
+        return self.values[name]
+
+    def inc(self, name, labels=None, value=1, help_text=''):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            series = self._series(name, 'counter', help_text)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, labels=None, help_text=''):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            self._series(name, 'gauge', help_text)[key] = value
+
+    def set_info(self, name, labels, help_text=''):
+        """
+        info 型 gauge (值恒为 1，信息放在标签里): 只保留最新的一组标签，例如模型版本
+        """
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self._series(name, 'gauge', help_text)
+            series.clear()
+            series[key] = 1
+
+    def observe(self, name, value, labels=None, help_text=''):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            series = self._series(name, 'histogram', help_text)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def render(self):
+        lines = []
+        pid_label = (('pid', str(os.getpid())),)  # fork 之后各 worker 的 pid 不同，输出时再取
+        with self.lock:
+            for name, (kind, help_text) in self.meta.items():
+                if help_text: lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in sorted(self.values[name].items()):
+                    labels = pid_label + key
+                    if kind != 'histogram':
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(value.buckets + ('+Inf',), value.counts):
+                        cumulative += n
+                        lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {value.sum}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+class StageTimer:
+    """
+    按阶段打点: 每次 mark(stage) 记录距上一次打点的耗时，finish() 记录整个请求
+        timer = StageTimer(metrics, 'recommend')
+        ...解析请求...
+        timer.mark('parse')
+    """
+    STAGE_METRIC = 'steam_stage_seconds'
+    STAGE_HELP = 'Per-stage latency of request handling'
+    REQUEST_METRIC = 'steam_request_seconds'
+
+    @classmethod
+    def record(cls, registry, endpoint, stage, seconds):
+        """
+        记一个阶段的耗时；不经过 StageTimer 打点的地方 (例如打分函数内部) 也走这里，保证 HELP 一致
+        """
+        registry.observe(cls.STAGE_METRIC, seconds, {'endpoint': endpoint, 'stage': stage}, help_text=cls.STAGE_HELP)
+
+    def __init__(self, registry, endpoint):
+        self.registry = registry
+        self.endpoint = endpoint
+        self.start = self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.record(self.registry, self.endpoint, stage, now - self.last)
+        self.last = now
+
+    def skip(self):
+        # 这段时间已经被更细的阶段记录过了 (例如 input / predict)，不重复记
+        self.last = time.perf_counter()
+
+    def finish(self, status):
+        elapsed = time.perf_counter() - self.start
+        labels = {'endpoint': self.endpoint}
+        self.registry.observe(self.REQUEST_METRIC, elapsed, labels, help_text='End-to-end request latency')
+        self.registry.inc('steam_requests_total', dict(labels, code=str(status)), help_text='Requests by status code')
+        if status >= 400:
+            self.registry.inc('steam_request_errors_total', dict(labels, code=str(status)), help_text='Failed requests')
+        return elapsed
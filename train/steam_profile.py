@@ -0,0 +1,186 @@
+import contextlib
+import json
+import resource
+import time
+import numpy as np
+import torch
+from deepctr_torch.callbacks import Callback
+
+# ==========================================
+# ⏱️ 训练剖析: 预处理各步骤耗时、每个 epoch 的吞吐、取数据 / 计算的耗时占比、峰值内存，写成一份 JSON 报告
+# 训练 step 的切分靠两个钩子: 模型前向之前 (step 开始) 和 optimizer.step() 之后 (step 结束)，
+# 上一个 step 结束到下一个 step 开始之间算作 "取数据" (DataLoader 取 batch + 训练循环自己的开销)；
+# 可选用 torch.profiler 录几个 step 的算子级 trace (chrome://tracing 打开)
+# 默认不启用，所有方法都是空操作，不影响正常训练
+# ==========================================
+
+def peak_memory_mb():
+    """
+    本进程和已结束的子进程 (DataLoader worker、数据并行的 rank) 的峰值 RSS (Linux 上 ru_maxrss 的单位是 KB)
+    """
+    peak = {'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)}
+    if torch.cuda.is_available():
+        peak['cuda_allocated'] = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+    return peak
+
+class TrainProfiler:
+    """
+    一次训练的剖析记录；模块级的 profiler 是全局实例，steam_train 的 --profile 打开它
+    """
+    def __init__(self):
+        self.enabled = False
+        self.trace_steps = 0
+        self.trace_path = None
+        self.stages = []  # 预处理各步骤 (按开始顺序，嵌套的用 / 连接)
+        self.epochs = []
+        self.trace = None
+        self._stack = []
+        self._epoch = None
+        self._prof = None
+
+    def enable(self, trace_steps=0, trace_path=None):
+        self.enabled = True
+        self.trace_steps, self.trace_path = trace_steps, trace_path
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        self._stack.append(name)
+        entry = {'stage': '/'.join(self._stack), 'seconds': None}
+        self.stages.append(entry)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry['seconds'] = round(time.perf_counter() - t0, 6)
+            self._stack.pop()
+
+    def attach(self, model, optimizer):
+        """
+        在 model 的前向和 optimizer 的 step 上打点 (model 是未经 DDP 包装的模块)
+        只统计开着梯度的前向，验证 / 预测 (no_grad) 不算训练 step
+        """
+        if not self.enabled: return
+        model.register_forward_pre_hook(self._step_begin)
+        optimizer.register_step_post_hook(self._step_end)
+
+    def _step_begin(self, module, args):
+        if self._epoch is None or not torch.is_grad_enabled(): return
+        now = time.perf_counter()
+        self._epoch['data'] += now - self._epoch['mark']
+        self._epoch['mark'] = now
+        self._epoch['steps'] += 1
+
+    def _step_end(self, optimizer, args, kwargs):
+        if self._epoch is None: return
+        now = time.perf_counter()
+        self._epoch['compute'] += now - self._epoch['mark']
+        self._epoch['mark'] = now
+        if self._prof is not None:
+            self._prof.step()
+
+    def epoch_begin(self, epoch):
+        if not self.enabled: return
+        if self.trace_steps and self._prof is None and self.trace is None:
+            self._start_trace()
+        now = time.perf_counter()
+        self._epoch = {'epoch': epoch + 1, 'start': now, 'mark': now, 'data': 0.0, 'compute': 0.0, 'steps': 0}
+
+    def epoch_end(self, samples):
+        """
+        在验证之后、写断点之前调用；samples 为本 epoch 训练过的样本数 (多进程时是所有 rank 的合计)
+        """
+        if not self.enabled or self._epoch is None: return
+        e, now = self._epoch, time.perf_counter()
+        train_seconds = e['mark'] - e['start']
+        self.epochs.append({
+            'epoch': e['epoch'],
+            'samples': int(samples),
+            'steps': e['steps'],
+            'seconds': round(now - e['start'], 4),
+            'train_seconds': round(train_seconds, 4),
+            'data_seconds': round(e['data'], 4),
+            'compute_seconds': round(e['compute'], 4),
+            'eval_seconds': round(now - e['mark'], 4),
+            'samples_per_sec': round(samples / train_seconds, 1) if train_seconds else None,
+            'data_fraction': round(e['data'] / train_seconds, 4) if train_seconds else None,
+            'peak_rss_mb': peak_memory_mb()['self'],
+        })
+        self._epoch = None
+
+    def _start_trace(self):
+        from torch.profiler import ProfilerActivity, profile, schedule
+        # 跳过第一个 step (冷启动)，预热一个 step 后录 trace_steps 个
+        self._prof = profile(activities=[ProfilerActivity.CPU], record_shapes=True,
+                             schedule=schedule(wait=1, warmup=1, active=self.trace_steps, repeat=1),
+                             on_trace_ready=self._trace_ready)
+        self._prof.start()
+
+    def _trace_ready(self, prof):
+        prof.export_chrome_trace(self.trace_path)
+        ops = sorted(prof.key_averages(), key=lambda e: e.self_cpu_time_total, reverse=True)[:15]
+        self.trace = {
+            'path': self.trace_path,
+            'steps': self.trace_steps,
+            'top_ops': [{'name': e.key, 'calls': e.count, 'self_cpu_ms': round(e.self_cpu_time_total / 1000, 3),
+                         'cpu_ms': round(e.cpu_time_total / 1000, 3)} for e in ops],
+        }
+        print(f"🔬 torch profiler trace 已保存: {self.trace_path} ({self.trace_steps} 个 step)")
+
+    def finish(self):
+        if self._prof is not None:
+            self._prof.stop()
+            self._prof = None
+
+    def summary(self):
+        train = sum(e['train_seconds'] for e in self.epochs)
+        data = sum(e['data_seconds'] for e in self.epochs)
+        rates = [e['samples_per_sec'] for e in self.epochs if e['samples_per_sec']]
+        return {
+            # 训练循环以外的顶层阶段 (加载数据、建模型、保存) 的合计
+            'stage_seconds': round(sum(s['seconds'] or 0 for s in self.stages if '/' not in s['stage']), 4),
+            'train_seconds': round(train, 4),
+            'eval_seconds': round(sum(e['eval_seconds'] for e in self.epochs), 4),
+            'median_samples_per_sec': round(float(np.median(rates)), 1) if rates else None,
+            'data_fraction': round(data / train, 4) if train else None,
+        }
+
+    def write(self, path, **info):
+        """
+        写 JSON 报告，info 里是调用方想一起记下的配置 (模式、batch、进程数等)
+        """
+        if not self.enabled: return None
+        self.finish()
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': dict(info, num_threads=torch.get_num_threads()),
+            'summary': self.summary(),
+            'preprocess': self.stages,
+            'epochs': self.epochs,
+            'peak_memory_mb': peak_memory_mb(),
+            'trace': self.trace,
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"⏱️ 训练剖析报告已保存: {path}")
+        return report
+
+class ProfileEpochs(Callback):
+    """
+    model.fit 的回调: 给 profiler 标出 epoch 的起止，需放在其它回调前面 (epoch 结束时先记时间，再写断点)
+    """
+    def __init__(self, profiler, samples):
+        super().__init__()
+        self.profiler = profiler
+        self.samples = samples
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.profiler.epoch_begin(epoch)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.profiler.epoch_end(self.samples)
+
+profiler = TrainProfiler()
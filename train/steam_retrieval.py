@@ -0,0 +1,125 @@
+import numpy as np
+import torch
+from deepctr_torch.inputs import SparseFeat, VarLenSparseFeat
+
+# ==========================================
+# 🔎 两阶段推荐的召回层: 用训练好的 DeepFM 自己的 embedding 建内积索引
+# DeepFM 的 logit = 一阶项 + FM 二阶项 + DNN。FM 里与 user_type 有关的只有 <e_user, e_item + e_tags>，
+# 只与 Item 有关的 (一阶项 + <e_item, e_tags>) 作为偏置放进 Item 向量的最后一维，于是
+#     召回分 = [e_user, 1] · [e_item + e_tags, bias]
+# 与 "一阶 + FM" 部分的排序完全一致，只差 DNN 项；召回几百个候选后再交给完整的 DeepFM 精排
+# ==========================================
+
+def _embedding_names(model):
+    # 与 BaseModel.input_from_feature_columns 的返回顺序一致: 先 SparseFeat，再 VarLenSparseFeat
+    cols = model.dnn_feature_columns
+    return ([fc.name for fc in cols if isinstance(fc, SparseFeat)] +
+            [fc.name for fc in cols if isinstance(fc, VarLenSparseFeat)])
+
+def extract_vectors(model, item_inputs, batch_size=4096):
+    """
+    从 eager DeepFM (已加载权重) 抽取召回向量
+    返回 Item 矩阵 (N, D+1) 和 user_type 查询矩阵 (T, D+1)，均为 float32 numpy
+    """
+    names = _embedding_names(model)
+    item_vecs = []
+    with torch.no_grad():
+        for start in range(0, len(item_inputs), batch_size):
+            X = item_inputs[start:start + batch_size]
+            sparse, _ = model.input_from_feature_columns(X, model.dnn_feature_columns, model.embedding_dict)
+            emb = {name: e.squeeze(1) for name, e in zip(names, sparse)}
+            # user_type 列是占位的 0，它在一阶项里贡献的常数对所有 Item 相同，不影响排序
+            bias = model.linear_model(X).squeeze(1) + (emb['item_id_idx'] * emb['tags']).sum(dim=1)
+            item_vecs.append(torch.cat([emb['item_id_idx'] + emb['tags'], bias.unsqueeze(1)], dim=1))
+        user_emb = model.embedding_dict['user_type_idx'].weight
+        user_vecs = torch.cat([user_emb, torch.ones(len(user_emb), 1, device=user_emb.device)], dim=1)
+    return (torch.cat(item_vecs).cpu().numpy().astype(np.float32),
+            user_vecs.cpu().numpy().astype(np.float32))
+
+def _top_k_unordered(scores, k):
+    # 候选之后还要精排，这里只需要集合，不需要有序
+    if k >= len(scores): return np.arange(len(scores))
+    return np.argpartition(-scores, k - 1)[:k]
+
+class ExactIndex:
+    """
+    精确内积检索: 一次 (N, D+1) 矩阵乘 + argpartition，召回率 100%，耗时随 N 线性增长
+    """
+    def __init__(self, item_vecs):
+        self.item_vecs = np.ascontiguousarray(item_vecs, dtype=np.float32)
+
+    def search(self, query, k):
+        return _top_k_unordered(self.item_vecs @ query, k)
+
+class IVFIndex:
+    """
+    近似内积检索 (倒排桶, IVF)
+    先把最大内积检索转成欧氏最近邻: Item 向量补一维 sqrt(M² - |x|²) 让所有向量等长，查询补 0，
+    则 |q - x|² = |q|² + M² - 2 q·x，距离越近内积越大。再用 k-means 把 Item 分进 nlist 个桶，
+    查询只扫离它最近的 nprobe 个桶 (不足 k 个时继续往下扫)。nprobe 越大召回率越高、也越慢
+    """
+    def __init__(self, item_vecs, nlist=None, nprobe=8, seed=2025, train_size=65536, iters=10):
+        item_vecs = np.ascontiguousarray(item_vecs, dtype=np.float32)
+        norms = (item_vecs ** 2).sum(axis=1)
+        x = torch.from_numpy(np.hstack([item_vecs, np.sqrt(norms.max() - norms)[:, None]]))
+        n = len(x)
+        rng = np.random.default_rng(seed)
+        sample = x[torch.from_numpy(rng.choice(n, min(n, train_size), replace=False))]
+        self.nlist = min(nlist or max(1, int(np.sqrt(n))), len(sample))
+        self.nprobe = nprobe
+
+        centroids = sample[torch.from_numpy(rng.choice(len(sample), self.nlist, replace=False))].clone()
+        for _ in range(iters):
+            assign = self._assign(sample, centroids)
+            sums = torch.zeros_like(centroids).index_add_(0, assign, sample)
+            counts = torch.bincount(assign, minlength=self.nlist)
+            nonempty = counts > 0  # 空桶保留原来的中心
+            centroids[nonempty] = sums[nonempty] / counts[nonempty].unsqueeze(1).float()
+
+        assign = self._assign(x, centroids).numpy()
+        order = np.argsort(assign, kind='stable')
+        self.centroids = centroids.numpy()
+        self.centroid_norms = (self.centroids ** 2).sum(axis=1)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=self.nlist))])
+        self.list_items = order  # 按桶排好的 Item 下标
+        self.list_vecs = item_vecs[order]  # 与 list_items 对齐，每个桶是一段连续内存
+
+    @staticmethod
+    def _assign(x, centroids, chunk=65536):
+        # argmin |x - c|² = argmax (2 x·c - |c|²)
+        c_norms = (centroids ** 2).sum(dim=1)
+        return torch.cat([(2 * x[i:i + chunk] @ centroids.T - c_norms).argmax(dim=1)
+                          for i in range(0, len(x), chunk)])
+
+    def search(self, query, k):
+        # 查询补的那一维是 0，只需要前 D+1 维参与距离
+        dist = self.centroid_norms - 2 * (self.centroids[:, :-1] @ query)
+        probe = np.argsort(dist)
+        sizes = np.diff(self.offsets)[probe]
+        num_probe = max(self.nprobe, int(np.searchsorted(np.cumsum(sizes), k) + 1))
+        spans = [(self.offsets[l], self.offsets[l + 1]) for l in probe[:num_probe]]
+        idx = np.concatenate([self.list_items[s:e] for s, e in spans])
+        vecs = np.concatenate([self.list_vecs[s:e] for s, e in spans])
+        return idx[_top_k_unordered(vecs @ query, k)]
+
+class Retriever:
+    """
+    召回层: 按 user_type_id 查询索引，返回 num_candidates 个 Item 下标 (无序)
+    """
+    def __init__(self, index, user_vecs, num_candidates):
+        self.index = index
+        self.user_vecs = user_vecs
+        self.num_candidates = num_candidates
+
+    def candidates(self, user_type_id, k=None):
+        return self.index.search(self.user_vecs[int(user_type_id)], k or self.num_candidates)
+
+def build_retriever(model, item_inputs, kind='exact', num_candidates=300, nlist=None, nprobe=8):
+    item_vecs, user_vecs = extract_vectors(model, item_inputs)
+    if kind == 'exact':
+        index = ExactIndex(item_vecs)
+    elif kind == 'ivf':
+        index = IVFIndex(item_vecs, nlist=nlist, nprobe=nprobe)
+    else:
+        raise ValueError(f"未知的召回索引类型: {kind}")
+    return Retriever(index, user_vecs, num_candidates)
@@ -1,159 +1,802 @@
 import pandas as pd
 import numpy as np
-import ast
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import queue
+import threading
 import torch
-from flask import Flask, request, jsonify
+from concurrent.futures import Future
+from flask import Flask, Response, request, jsonify
+from werkzeug.serving import make_server
 from pyngrok import ngrok
-from sklearn.preprocessing import LabelEncoder, MinMaxScaler
-from deepctr_torch.inputs import SparseFeat, DenseFeat, VarLenSparseFeat
+from sklearn.preprocessing import LabelEncoder
 from deepctr_torch.models import DeepFM
+from steam_metrics import CONTENT_TYPE, MetricsRegistry, StageTimer
+from steam_features import (artifacts_path_for, build_feature_columns, build_input_tensor, file_sha256,
+                            load_artifacts, load_inference_module)
+from steam_cache import feature_spec_from, load_features
+from steam_retrieval import build_retriever
 
 class ServiceConfig:
     CSV_PATH = '../data/steam/deepfm_train_100k.csv'
     MODEL_PATH = 'deepfm_steam_weights.pth'
+    ARTIFACTS_PATH = artifacts_path_for(MODEL_PATH)  # steam_train 产出的预处理 bundle，存在时不再读 CSV
+    # 推理模式: 'eager' 直接跑 deepctr 的 DeepFM；'traced' 加载 steam_export.py 导出的 TorchScript 图 (可含 int8/fp16)
+    INFERENCE_MODE = 'eager'
+    TRACED_MODEL_PATH = 'deepfm_steam_infer.pt'
     MAX_TAG_LEN = 5
+    FEATURE_CACHE = True  # 没有 artifacts 时从 CSV 冷启动，编码结果按 CSV 哈希缓存
+    FEATURE_CACHE_DIR = '.feature_cache'
     EMBEDDING_DIM = 32
     DNN_HIDDEN_UNITS = (128, 64)
     DNN_DROPOUT = 0.5
     DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+    HOST = '127.0.0.1'
     PORT = 5000
+    # 多进程模式: 父进程 init_model() 后 fork 出 WORKERS 个进程共享监听端口和只读的模型/Item 张量
+    WORKERS = 1
+    THREADS_PER_WORKER = None  # 每个 worker 的 torch intra-op 线程数，None 表示 CPU 核数 / WORKERS
+    SCORE_TABLE = True  # 启动时预计算 (user_type × item) 打分表，请求直接查表
+    INFER_BATCH_SIZE = 4096
+    # 动态微批: 并发请求先排队，攒够 MAX_SIZE 个或等满 MAX_WAIT_MS 后合并成一次前向
+    MICRO_BATCH = False
+    MICRO_BATCH_MAX_SIZE = 32
+    MICRO_BATCH_MAX_WAIT_MS = 2.0
+    # 热更新: 后台构建新版本后原子替换，进行中的请求在旧版本上算完
+    RELOAD_WATCH = False  # 轮询权重 / artifacts 文件，变化后自动重建
+    RELOAD_POLL_SECONDS = 5.0
+    ADMIN_TOKEN = None  # 设置后开放 POST /admin/reload (请求头 X-Admin-Token)
+    # 两阶段推荐: 用 DeepFM 的 embedding 建内积索引先召回候选，现场打分时只对候选跑 DeepFM (打分表未命中时生效)
+    RETRIEVAL = False
+    RETRIEVAL_INDEX = 'exact'  # 'exact' 精确内积；'ivf' 近似倒排桶，召回率由 RETRIEVAL_NPROBE 调节
+    RETRIEVAL_CANDIDATES = 300
+    RETRIEVAL_NLIST = None  # ivf 的桶数，None 表示 sqrt(游戏数)
+    RETRIEVAL_NPROBE = 8
+    # 每个请求往 stdout 打一行 (调试用)；打印比查打分表还慢，线上看 /metrics 的请求计数和阶段耗时
+    LOG_REQUESTS = False
     NGROK_TOKEN = "这里粘贴你的_Ngrok_Token"
 
 cfg = ServiceConfig()
 
-def pad_sequences(sequences, maxlen, value=0):
-    result = np.full((len(sequences), maxlen), value, dtype=np.int32)
-    for i, seq in enumerate(sequences):
-        if len(seq) > 0:
-            trunc = seq[:maxlen]
-            result[i, :len(trunc)] = trunc
-    return result
-
-# 全局保存 user encoder，用于把 "Hardcore_FPS" 转成数字
+# 最近一次加载的 user encoder，用于把 "Hardcore_FPS" 转成数字；build_state 会把它收进 ServingState，请求只读 state.user_lbe
 global_user_lbe = None
 
 def load_data_struct(csv_path, config):
     print(f"📂 [Service] 读取数据索引: {csv_path} ...")
     try:
-        data = pd.read_csv(csv_path)
-    except FileNotFoundError: return None, None, None
-
-    data['tags_list'] = data['tags_list'].apply(lambda x: ast.literal_eval(x))
+        # 与 steam_train 共用编码逻辑和特征缓存，同一份 CSV 第二次启动直接 memory-map
+        columns, meta = load_features(csv_path, config.MAX_TAG_LEN, config.FEATURE_CACHE_DIR if config.FEATURE_CACHE else None)
+    except FileNotFoundError: return None, None, None, None
+    
+    # UserType (🔥 关键：保存这个 encoder，classes_ 与训练时一致)
+    global global_user_lbe
+    global_user_lbe = LabelEncoder()
+    global_user_lbe.classes_ = meta['encoders']['user_type']
+    print(f"🔥 支持的玩家类型: {list(global_user_lbe.classes_)}")
     
-    # 1. Tag
-    all_tags = [tag for sublist in data['tags_list'] for tag in sublist]
-    tag_lbe = LabelEncoder()
-    tag_lbe.fit(all_tags)
-    max_tag_id = len(tag_lbe.classes_) + 1
-    data['tags_list_idx'] = data['tags_list'].apply(lambda x: [i+1 for i in tag_lbe.transform(x)] if len(x)>0 else [])
+    feature_columns = build_feature_columns(feature_spec_from(meta, config.EMBEDDING_DIM))
     
-    # 2. Item
-    item_lbe = LabelEncoder()
-    data['item_id_idx'] = item_lbe.fit_transform(data['item_id'])
-    max_item_id = data['item_id_idx'].max() + 1
+    # Item 表: 交互日志里同一个游戏会出现很多次 (每个看过它的用户一行)，
+    # 但打分只需要每个游戏一行，缓存里存的就是按 item_id 去重、补齐好 tags 的 Item 表
+    table = meta['item_table']
+    item_df = pd.DataFrame({col: values for col, values in table.items() if col != 'tags'})
+    print(f"🕹️ 交互记录 {meta['num_rows']} 条 -> 去重后游戏 {len(item_df)} 个")
     
-    # 3. UserType (🔥 关键：保存这个 encoder)
+    return feature_columns, feature_columns, item_df, table['tags']
+
+def load_data_from_artifacts(bundle):
+    """
+    从 steam_train 保存的 bundle 冷启动: 编码器、特征规格和 Item 表都是现成的，不碰 CSV
+    """
     global global_user_lbe
     global_user_lbe = LabelEncoder()
-    # 必须 fit 所有的类型，保证和训练时 ID 一致
-    data['user_type_idx'] = global_user_lbe.fit_transform(data['user_type'])
-    max_user_type_id = data['user_type_idx'].max() + 1
+    global_user_lbe.classes_ = bundle['encoders']['user_type']
     print(f"🔥 支持的玩家类型: {list(global_user_lbe.classes_)}")
     
-    # 4. Price
-    mms = MinMaxScaler(feature_range=(0, 1))
-    data['price_norm'] = mms.fit_transform(data[['price']])
-    
-    fixlen_feature_columns = [
-        SparseFeat('item_id_idx', vocabulary_size=max_item_id, embedding_dim=config.EMBEDDING_DIM),
-        SparseFeat('user_type_idx', vocabulary_size=max_user_type_id, embedding_dim=config.EMBEDDING_DIM), # 🔥
-        DenseFeat('price_norm', dimension=1)
-    ]
-    varlen_feature_columns = [
-        VarLenSparseFeat(
-            SparseFeat('tags', vocabulary_size=max_tag_id, embedding_dim=config.EMBEDDING_DIM),
-            maxlen=config.MAX_TAG_LEN, combiner='mean', length_name=None
-        )
-    ]
-    return fixlen_feature_columns + varlen_feature_columns, fixlen_feature_columns + varlen_feature_columns, data
+    feature_columns = build_feature_columns(bundle['feature_spec'])
+    table = bundle['item_table']
+    item_df = pd.DataFrame({col: values for col, values in table.items() if col != 'tags'})
+    print(f"📦 [Service] 从 artifacts 加载 Item 表: {len(item_df)} 个游戏")
+    return feature_columns, feature_columns, item_df, table['tags']
 
 app = Flask(__name__)
-model_steam = None
-full_data_df = None
 
-def init_model():
-    global model_steam, full_data_df
-    linear_cols, dnn_cols, df = load_data_struct(cfg.CSV_PATH, cfg)
-    if linear_cols is None: return
-    full_data_df = df
+class ServingState:
+    """
+    一个模型版本对外服务需要的全部只读数据: 模型、编码器、Item 表及其输入张量、打分表
+    热更新时在后台完整构建一个新对象，再一次性替换全局引用 state；
+    每个请求开头只取一次引用并全程使用它，所以进行中的请求总是在同一个版本上算完
+    """
+    def __init__(self, model, feature_index, user_lbe, items, item_inputs, version):
+        self.model = model
+        self.feature_index = feature_index  # 特征名 -> 输入矩阵中的列区间，traced 模式下模型上没有这个属性，单独保存
+        self.user_lbe = user_lbe
+        self.item_df = items  # 每个游戏一行的 Item 表
+        self.item_inputs = item_inputs  # 与 item_df 行对齐、与请求无关的模型输入张量 (已在 cfg.DEVICE 上)
+        self.item_columns = build_item_columns(items)  # 与 item_df 行对齐的返回字段列数组
+        self.version = version  # 权重文件 sha256 的前 12 位
+        self.retriever = None  # 开启 RETRIEVAL 时的召回层
+        # 预计算打分表: {user_type 字符串: 按分数降序的推荐列表}
+        # 分数只依赖 (user_type, item)，而 user_type 只有 15 种，所以可以一次算完；换权重就是换一个新的 state
+        self.score_table = {}
+
+state = None  # 当前对外服务的 ServingState，只整体替换，不原地修改
+reload_lock = threading.Lock()  # 同一时间只允许一个后台构建
+scheduler = None  # 开启 MICRO_BATCH 时的微批调度器
+watcher = None  # 开启 RELOAD_WATCH 时的权重文件监视线程
+metrics = MetricsRegistry()  # 各阶段耗时直方图、请求/错误计数等，/metrics 输出
+
+def build_state():
+    """
+    按当前配置从磁盘构建一个完整的新版本 (含打分表)；任何一步失败都返回 None，不影响正在服务的版本
+    """
+    model_spec = {'dnn_hidden_units': cfg.DNN_HIDDEN_UNITS, 'dnn_dropout': cfg.DNN_DROPOUT}
+    if os.path.exists(cfg.ARTIFACTS_PATH):
+        try:
+            bundle = load_artifacts(cfg.ARTIFACTS_PATH, cfg.MODEL_PATH)
+        except (ValueError, FileNotFoundError) as e:
+            # bundle 和权重对不上时宁可不启动，也不要返回错位的推荐
+            print(f"❌ 拒绝加载: {e}")
+            return None
+        linear_cols, dnn_cols, items, tags = load_data_from_artifacts(bundle)
+        model_spec = bundle['model_spec']
+        version = bundle['weights_sha256'][:12]
+    else:
+        print(f"⚠️ 未找到 {cfg.ARTIFACTS_PATH}，回退为读取 CSV 重建编码器")
+        linear_cols, dnn_cols, items, tags = load_data_struct(cfg.CSV_PATH, cfg)
+        if linear_cols is None: return None
+        try:
+            version = file_sha256(cfg.MODEL_PATH)[:12]
+        except FileNotFoundError as e:
+            print(f"❌ 错误: {e}")
+            return None
+    
+    eager = DeepFM(linear_feature_columns=linear_cols, dnn_feature_columns=dnn_cols, task='binary', 
+                   dnn_hidden_units=model_spec['dnn_hidden_units'], dnn_dropout=model_spec['dnn_dropout'], device=cfg.DEVICE)
+    feature_index = eager.feature_index
+    inputs = build_item_inputs(feature_index, items, tags)
+    model = load_weights(eager, cfg.MODEL_PATH)
+    if model is None: return None
     
-    model_steam = DeepFM(linear_feature_columns=linear_cols, dnn_feature_columns=dnn_cols, task='binary', 
-                         dnn_hidden_units=cfg.DNN_HIDDEN_UNITS, dnn_dropout=cfg.DNN_DROPOUT, device=cfg.DEVICE)
+    st = ServingState(model, feature_index, global_user_lbe, items, inputs, version)
+    if cfg.RETRIEVAL and len(items) > cfg.RETRIEVAL_CANDIDATES:
+        if model is not eager:
+            # traced 图里拿不到 embedding_dict，召回向量从同一份权重的 eager 模型里抽
+            eager.load_state_dict(torch.load(cfg.MODEL_PATH, map_location=cfg.DEVICE))
+        t0 = time.perf_counter()
+        st.retriever = build_retriever(eager.eval(), inputs, cfg.RETRIEVAL_INDEX, cfg.RETRIEVAL_CANDIDATES,
+                                       cfg.RETRIEVAL_NLIST, cfg.RETRIEVAL_NPROBE)
+        print(f"🔎 召回索引就绪: {cfg.RETRIEVAL_INDEX}, 每次召回 {cfg.RETRIEVAL_CANDIDATES} 个候选, "
+              f"耗时 {time.perf_counter() - t0:.2f}s")
+    if cfg.SCORE_TABLE:
+        st.score_table = build_score_table(st)
+    return st
+
+def publish_state(st, t0):
+    """
+    原子替换当前版本 (一次引用赋值)，并更新版本相关的指标；返回被换下的旧版本
+    """
+    global state
+    old, state = state, st
+    metrics.set_info('steam_model_info', {'version': st.version}, help_text='Model version currently serving')
+    metrics.set('steam_model_load_seconds', round(time.perf_counter() - t0, 6),
+                help_text='Wall time of the last model build (data, model, weights, score table)')
+    metrics.set('steam_model_loaded_timestamp_seconds', round(time.time(), 3),
+                help_text='Unix time the serving model was swapped in')
+    return old
+
+def init_model():
+    t0 = time.perf_counter()
+    st = build_state()
+    if st is None: return
+    publish_state(st, t0)
+    print(f"🏷️ 模型版本: {st.version}")
+
+def reload_model(reason='manual'):
+    """
+    热更新: 在调用线程里构建新版本，完成后原子替换；构建期间旧版本照常服务，失败时保留旧版本
+    返回新的 ServingState，失败返回 None
+    """
+    with reload_lock:
+        t0 = time.perf_counter()
+        old_version = state.version if state is not None else None
+        print(f"🔄 热更新 ({reason}): 后台构建新版本，当前 {old_version} 继续服务 ...")
+        st = build_state()
+        if st is None:
+            metrics.inc('steam_model_reloads_total', {'result': 'failed'}, help_text='Hot reload attempts by result')
+            print(f"❌ 热更新失败，继续使用 {old_version}")
+            return None
+        publish_state(st, t0)
+        metrics.inc('steam_model_reloads_total', {'result': 'ok'}, help_text='Hot reload attempts by result')
+        print(f"✅ 热更新完成: {old_version} -> {st.version}, 耗时 {time.perf_counter() - t0:.2f}s")
+        return st
+
+def start_reload(reason='manual'):
+    """
+    在后台线程里热更新；已有构建在进行时返回 False
+    """
+    if reload_lock.locked(): return False
+    threading.Thread(target=reload_model, args=(reason,), name="model-reload", daemon=True).start()
+    return True
+
+class ModelWatcher:
+    """
+    轮询权重 / artifacts / 推理图文件的 (mtime, size)，变化后且连续两次轮询一致 (文件写完) 才触发热更新
+    steam_train 先写权重再写 artifacts，中间状态会因 sha256 不匹配被拒绝，等 artifacts 写完的下一次变化再试
+    """
+    def __init__(self, paths, interval, on_change):
+        self.paths = list(paths)
+        self.interval = interval
+        self.on_change = on_change
+        self.current = self._signature()
+        self.worker = threading.Thread(target=self._loop, name="model-watcher", daemon=True)
+        self.worker.start()
+
+    def _signature(self):
+        sig = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        return tuple(sig)
+
+    def _loop(self):
+        pending = None
+        while True:
+            time.sleep(self.interval)
+            sig = self._signature()
+            if sig == self.current:
+                pending = None
+            elif sig != pending:
+                pending = sig  # 文件可能还在写，下一个周期确认没再变化
+            else:
+                self.current, pending = sig, None
+                self.on_change('watch')
+
+def start_scheduler():
+    """
+    按配置启动微批调度器 (后台线程不会跟着 fork 走，多进程模式下每个 worker 各自启动)
+    """
+    global scheduler
+    if cfg.MICRO_BATCH and state is not None:
+        scheduler = ScoringScheduler(score_live, cfg.MICRO_BATCH_MAX_SIZE, cfg.MICRO_BATCH_MAX_WAIT_MS)
+        print(f"🚦 微批调度已开启: max_batch={cfg.MICRO_BATCH_MAX_SIZE}, max_wait={cfg.MICRO_BATCH_MAX_WAIT_MS}ms")
+
+def start_watcher():
+    """
+    按配置启动权重文件监视线程 (同 start_scheduler，多进程模式下每个 worker 各自监视、各自重建)
+    """
+    global watcher
+    if cfg.RELOAD_WATCH and state is not None:
+        paths = [cfg.MODEL_PATH, cfg.ARTIFACTS_PATH]
+        if cfg.INFERENCE_MODE == 'traced':
+            paths.append(cfg.TRACED_MODEL_PATH)
+        watcher = ModelWatcher(paths, cfg.RELOAD_POLL_SECONDS, reload_model)
+        print(f"👀 监视模型文件变化 (每 {cfg.RELOAD_POLL_SECONDS}s): {paths}")
+
+def build_item_inputs(feature_index, items, tags):
+    """
+    一次性构造与请求无关的模型输入: 按 feature_index 的列顺序拼成 (N, D) 的 float32 连续张量并放到 cfg.DEVICE
+    DeepCTR 的 forward 只接收一个拼好的 float 矩阵 (稀疏列在内部再转 long)，user_type 列先占位为 0，打分时再填
+    """
+    num_items = len(items)
+    feats = {
+        'item_id_idx': items['item_id_idx'].to_numpy(dtype=np.int64),
+        'user_type_idx': np.zeros(num_items, dtype=np.int64),
+        'price_norm': items['price_norm'].to_numpy(dtype=np.float32),
+        'tags': np.asarray(tags, dtype=np.int64),
+    }
+    return build_input_tensor(feature_index, feats, num_items).to(cfg.DEVICE)
+
+def load_weights(model, model_path):
+    """
+    把权重加载进新建的 DeepFM，返回可直接推理的模块；失败返回 None
+    traced 模式下返回由这份权重导出的推理图，来源不一致时拒绝加载
+    """
     try:
-        model_steam.load_state_dict(torch.load(cfg.MODEL_PATH, map_location=cfg.DEVICE))
-        model_steam.eval()
+        if cfg.INFERENCE_MODE == 'traced':
+            model, meta = load_inference_module(cfg.TRACED_MODEL_PATH, model_path, map_location=cfg.DEVICE)
+            print(f"⚡ 使用导出的推理图: {cfg.TRACED_MODEL_PATH} (quantize={meta.get('quantize')}, emb_dtype={meta.get('emb_dtype')})")
+        else:
+            model.load_state_dict(torch.load(model_path, map_location=cfg.DEVICE))
+        model.eval()
         print("✅ 模型加载成功！")
-    except Exception as e: print(f"❌ 错误: {e}")
+        return model
+    except Exception as e:
+        print(f"❌ 错误: {e}")
+        return None
+
+def candidate_count(st, top_k):
+    """
+    召回时每种类型要取的候选数: top_k 不超过 RETRIEVAL_CANDIDATES 时返回 None (用默认值)，否则按 top_k 取，
+    保证结果不会被候选数截断；默认请求都是 None，微批调度仍能把它们合成一批
+    """
+    if st.retriever is None or top_k is None or top_k <= st.retriever.num_candidates: return None
+    return top_k
+
+def score_items(user_type_id, st=None, num_candidates=None):
+    """
+    给单一 user_type 现场打分，返回与 item_df 对齐的分数 (开启召回时只有候选位置有分数，见 score_live)
+    """
+    return score_live([user_type_id], st, num_candidates)[0]
+
+def score_live(user_type_ids, st=None, num_candidates=None):
+    """
+    请求路径上的现场打分: 有召回层时先召回再精排，否则对全量游戏打分
+    num_candidates 只在有召回层时生效，None 表示 RETRIEVAL_CANDIDATES
+    """
+    if st is None: st = state
+    if st.retriever is not None:
+        return score_candidates(user_type_ids, st, num_candidates)
+    return score_user_types(user_type_ids, st)
+
+def score_candidates(user_type_ids, st=None, num_candidates=None):
+    """
+    两阶段打分: 每种类型先从召回索引取 num_candidates (默认 RETRIEVAL_CANDIDATES) 个候选，再把所有候选堆叠成一次 DeepFM 前向
+    返回与 score_user_types 同形状的 (len(user_type_ids), N) 分数矩阵，非候选位置为 -inf (rank_items 会丢掉)
+    """
+    if st is None: st = state
+    t0 = time.perf_counter()
+    cands = [st.retriever.candidates(t, num_candidates) for t in user_type_ids]
+    t1 = time.perf_counter()
+    start_col, end_col = st.feature_index['user_type_idx']
+    rows = torch.as_tensor(np.concatenate(cands), device=st.item_inputs.device)
+    x = st.item_inputs[rows]  # 花式索引得到的是副本，可以直接改 user_type 列
+    type_col = np.repeat(np.asarray(user_type_ids, dtype=np.float32), [len(c) for c in cands])
+    x[:, start_col:end_col] = torch.as_tensor(type_col, device=x.device).unsqueeze(1)
+    t2 = time.perf_counter()
+    with torch.no_grad():
+        flat = torch.cat([st.model(x[i:i + cfg.INFER_BATCH_SIZE]) for i in range(0, len(x), cfg.INFER_BATCH_SIZE)])
+    flat = flat.reshape(-1).cpu().numpy()
+    t3 = time.perf_counter()
+    
+    scores = np.full((len(cands), len(st.item_inputs)), -np.inf, dtype=np.float32)
+    offset = 0
+    for i, cand in enumerate(cands):
+        scores[i, cand] = flat[offset:offset + len(cand)]
+        offset += len(cand)
+    StageTimer.record(metrics, 'scoring', 'retrieve', t1 - t0)
+    StageTimer.record(metrics, 'scoring', 'input', t2 - t1)
+    StageTimer.record(metrics, 'scoring', 'predict', t3 - t2)
+    return scores
+
+def score_user_types(user_type_ids, st=None):
+    """
+    一次前向同时给多种 user_type 打分: 把 item_inputs 按类型数堆叠，返回 (len(user_type_ids), N) 的分数矩阵
+    st 为 None 时使用当前版本
+    """
+    if st is None: st = state
+    item_inputs = st.item_inputs
+    # 我们有 N 个游戏，需要构造 N 个 user_type_id
+    # 也就是：[2, 2, 2, ..., 2] (长度等于游戏数量)
+    # 意思是：预测“这个特定的玩家”对“每一个游戏”的喜好
+    # 其余特征都在 item_inputs 里缓存好了，每个请求只需要填 user_type 这一列
+    start_col, end_col = st.feature_index['user_type_idx']
+    type_col = torch.as_tensor(np.asarray(user_type_ids, dtype=np.float32), device=item_inputs.device)
+    num_types = len(type_col)
+    
+    scores = []
+    input_cost = predict_cost = 0.0
+    with torch.no_grad():
+        for start in range(0, len(item_inputs), cfg.INFER_BATCH_SIZE):
+            t0 = time.perf_counter()
+            chunk = item_inputs[start:start + cfg.INFER_BATCH_SIZE]
+            # 堆叠成 [类型0 的所有游戏; 类型1 的所有游戏; ...]，一次 forward 算完
+            x = chunk.repeat(num_types, 1)
+            x[:, start_col:end_col] = type_col.repeat_interleave(len(chunk)).unsqueeze(1)  # 🔥 这里填入的是全量的单一用户ID
+            t1 = time.perf_counter()
+            scores.append(st.model(x).reshape(num_types, len(chunk)))
+            input_cost += t1 - t0
+            predict_cost += time.perf_counter() - t1
+    scores = torch.cat(scores, dim=1).cpu().numpy()
+    StageTimer.record(metrics, 'scoring', 'input', input_cost)
+    StageTimer.record(metrics, 'scoring', 'predict', predict_cost)
+    return scores
+
+class ScoringScheduler:
+    """
+    动态微批调度器: 把并发请求的打分任务排队，攒成一批后只跑一次堆叠前向
+    每个 Flask 线程各自 forward 会重复计算，还会争抢 torch 的 intra-op 线程；
+    这里用一个后台线程独占模型，用一点排队延迟换吞吐
+    """
+    def __init__(self, score_fn, max_batch_size=32, max_wait_ms=2.0):
+        self.score_fn = score_fn  # (user_type_ids, state, num_candidates) -> (len(ids), N) 分数矩阵
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.num_batches = 0
+        self.num_requests = 0
+        self.max_batch_seen = 0
+        self.batch_size_hist = {}  # {批大小: 次数}
+        self.worker = threading.Thread(target=self._loop, name="scoring-scheduler", daemon=True)
+        self.worker.start()
+
+    def submit(self, user_type_id, st, num_candidates=None):
+        # 带上请求开始时拿到的版本: 热更新前后排进同一批的请求各自在自己的版本上打分
+        future = Future()
+        self.queue.put((st, num_candidates, int(user_type_id), future))
+        return future
+
+    def score(self, user_type_id, st, num_candidates=None):
+        """
+        阻塞等待本请求所在批次算完，返回与 st.item_df 对齐的分数
+        """
+        return self.submit(user_type_id, st, num_candidates).result()
+
+    def _collect(self):
+        # 阻塞等第一个任务，然后在时间窗口内尽量多收
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0: break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            # 按 (版本, 候选数) 分组: 正常只有一组，热更新的瞬间或有请求要的 top_k 超过默认候选数时才会多出来
+            groups = {}
+            for st, k, t, future in batch:
+                groups.setdefault((st, k), []).append((t, future))
+            for (st, k), jobs in groups.items():
+                # 同一类型在一批里只算一次
+                type_ids = sorted({t for t, _ in jobs})
+                try:
+                    scores = dict(zip(type_ids, self.score_fn(type_ids, st, k)))
+                    for t, future in jobs:
+                        future.set_result(scores[t])
+                except Exception as e:
+                    for _, future in jobs:
+                        future.set_exception(e)
+            with self.lock:
+                self.num_batches += 1
+                self.num_requests += len(batch)
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+                self.batch_size_hist[len(batch)] = self.batch_size_hist.get(len(batch), 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "batches": self.num_batches,
+                "requests": self.num_requests,
+                "avg_batch_size": round(self.num_requests / self.num_batches, 3) if self.num_batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "batch_size_hist": dict(sorted(self.batch_size_hist.items())),
+                "max_wait_ms": self.max_wait_ms,
+                "max_batch_limit": self.max_batch_size,
+            }
+
+def top_k_indices(scores, top_k=None):
+    """
+    返回分数最高的 top_k 个下标 (降序)，语义与 sort_values(...).head(top_k) 一致
+    只需要少数几个时用 argpartition 做 O(N) 的部分选择，不再对全量做 O(N log N) 排序
+    """
+    scores = np.asarray(scores).ravel()
+    n = len(scores)
+    if top_k is None or top_k <= 0 or top_k >= n:
+        # 需要全量 (或 head 的负数语义) 时才完整排序
+        order = np.lexsort((np.arange(n), -scores))
+        return order if top_k is None else order[:top_k]
+    cand = np.argpartition(-scores, top_k - 1)[:top_k]
+    # 候选内部按 (分数降序, 下标升序) 排，保证同分时顺序稳定
+    return cand[np.lexsort((cand, -scores[cand]))]
+
+def build_item_columns(items):
+    """
+    把 Item 表拆成接口需要的列数组，组装结果时直接按下标取值，不用复制 DataFrame
+    """
+    return {
+        "id": items['item_id'].astype(str).to_numpy(dtype=object),
+        "title": items['title'].to_numpy(dtype=object),
+        "cover": items['cover_url'].to_numpy(dtype=object),
+        "tags": items['tag_names'].to_numpy(dtype=object),
+    }
+
+def build_results(columns, idx, scores):
+    """
+    按下标从列数组里组装接口返回的列表
+    """
+    return [{
+        "id": i, "title": t, "score": float(sc), "cover": c, "tags": g
+    } for i, t, sc, c, g in zip(columns['id'][idx].tolist(), columns['title'][idx].tolist(),
+                                np.asarray(scores).ravel()[idx].tolist(),
+                                columns['cover'][idx].tolist(), columns['tags'][idx].tolist())]
+
+def rank_items(scores, top_k=None, st=None):
+    """
+    按分数排序，组装成接口返回的列表；top_k=None 表示保留全部
+    """
+    if st is None: st = state
+    idx = top_k_indices(scores, top_k)
+    if st.retriever is not None:
+        idx = idx[np.isfinite(np.asarray(scores).ravel()[idx])]  # 丢掉没被召回的 (-inf)
+    return build_results(st.item_columns, idx, scores)
+
+def build_score_table(st):
+    """
+    对每一种 user_type 跑一次全量打分，缓存完整的排序结果
+    """
+    classes = st.user_lbe.classes_
+    print(f"🧮 预计算打分表: {len(classes)} 种玩家类型 ...")
+    # 所有类型堆叠在一次前向里算完
+    all_scores = score_user_types(np.arange(len(classes)), st)
+    table = {}
+    for user_type_id, user_type_str in enumerate(classes):
+        table[user_type_str] = rank_items(all_scores[user_type_id], st=st)
+    print(f"✅ 打分表就绪: 每种类型 {len(next(iter(table.values()), []))} 个游戏")
+    return table
+
+def respond(timer, payload, status=200):
+    """
+    序列化响应并结束计时 (serialize 阶段 + 请求总耗时 + 状态码计数)
+    """
+    resp = jsonify(payload)
+    timer.mark('serialize')
+    timer.finish(status)
+    return resp, status
+
+def parse_query(q):
+    """
+    校验批量接口里的一条查询，返回 (type, top_k)；格式不对时抛 ValueError，由调用方转成 400
+    """
+    if not isinstance(q, dict):
+        raise ValueError("query must be an object like {\"type\": \"Hardcore_FPS\", \"top_k\": 5}")
+    user_type_str, top_k = q.get('type', 'Hardcore_FPS'), q.get('top_k', 3)
+    if not isinstance(user_type_str, str):
+        raise ValueError("type must be a string")
+    # bool 是 int 的子类，单独排除；0 / 负数在打分表切片和 top_k_indices 里含义不同，一并拒绝
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 1:
+        raise ValueError("top_k must be a positive integer")
+    return user_type_str, top_k
 
 @app.route('/recommend', methods=['POST'])
 def recommend():
-    if model_steam is None: return jsonify({"error": "Model not loaded"}), 500
+    timer = StageTimer(metrics, 'recommend')
+    st = state  # 整个请求只用这一个版本，热更新不会让它中途换模型
+    if st is None: return respond(timer, {"error": "Model not loaded"}, 500)
     try:
         req_json = request.json
         top_k = req_json.get('top_k', 3)
         # 获取请求的玩家类型，默认 Hardcore_FPS
         user_type_str = req_json.get('type', 'Hardcore_FPS') 
+        timer.mark('parse')
         
         # 🔥 1. 将类型字符串转为 ID
-        if user_type_str not in global_user_lbe.classes_:
-            return jsonify({"error": f"Unknown type: {user_type_str}. Supported: {list(global_user_lbe.classes_)}"}), 400
+        if user_type_str not in st.user_lbe.classes_:
+            return respond(timer, {"error": f"Unknown type: {user_type_str}. Supported: {list(st.user_lbe.classes_)}"}, 400)
         
         # 拿到对应的数字 ID (例如 2)
-        user_type_id = global_user_lbe.transform([user_type_str])[0]
+        user_type_id = st.user_lbe.transform([user_type_str])[0]
         
-        print(f"🎮 收到请求: Type={user_type_str}(ID={user_type_id}), Top {top_k}")
+        if cfg.LOG_REQUESTS:
+            print(f"🎮 收到请求: Type={user_type_str}(ID={user_type_id}), Top {top_k}")
+        timer.mark('encode')
 
-        # 🔥 2. 构造全量输入 (关键步骤)
-        # 我们有 N 个游戏，需要构造 N 个 user_type_id
-        # 也就是：[2, 2, 2, ..., 2] (长度等于游戏数量)
-        # 意思是：预测“这个特定的玩家”对“每一个游戏”的喜好
-        num_items = len(full_data_df)
-        user_type_col = np.full(num_items, user_type_id) 
+        # 🔥 2. 命中预计算打分表时直接切片；否则现场构造全量输入打分
+        if user_type_str in st.score_table:
+            results = st.score_table[user_type_str][:top_k]
+            timer.mark('lookup')
+        else:
+            num_candidates = candidate_count(st, top_k)
+            if scheduler is not None:
+                scores = scheduler.score(user_type_id, st, num_candidates)
+                timer.mark('queue')  # 排队 + 所在批次的前向
+            else:
+                scores = score_items(user_type_id, st, num_candidates)
+                timer.skip()  # retrieve / input / predict 已在打分函数里分别记录
+            results = rank_items(scores, top_k, st)
+            timer.mark('rank')
+        
+        return respond(timer, {"code": 200, "type": user_type_str, "data": results, "model_version": st.version})
+    except Exception as e:
+        return respond(timer, {"error": str(e)}, 500)
 
-        tags_padded = pad_sequences(list(full_data_df['tags_list_idx']), maxlen=cfg.MAX_TAG_LEN)
+@app.route('/recommend/batch', methods=['POST'])
+def recommend_batch():
+    """
+    一次请求拿多种玩家类型的推荐 (前端一个页面渲染多个货架)
+    输入: {"queries": [{"type": "Hardcore_FPS", "top_k": 5}, {"type": "RPG_Story"}]}
+    所有需要现场打分的类型在一次堆叠前向里算完，而不是 N 次单独请求各跑一遍
+    """
+    timer = StageTimer(metrics, 'recommend_batch')
+    st = state
+    if st is None: return respond(timer, {"error": "Model not loaded"}, 500)
+    try:
+        t0 = time.perf_counter()
+        body = request.json
+        queries = body.get('queries', []) if isinstance(body, dict) else None
+        if not isinstance(queries, list) or not queries:
+            return respond(timer, {"error": "queries must be a non-empty list"}, 400)
         
-        model_input = {
-            'item_id_idx': full_data_df['item_id_idx'].values,
-            'user_type_idx': user_type_col,  # 🔥 这里传入的是全量的单一用户ID
-            'price_norm': full_data_df['price_norm'].values,
-            'tags': tags_padded
-        }
+        # 先校验全部查询再打分，出错时指出是第几条
+        parsed = []
+        for i, q in enumerate(queries):
+            try:
+                parsed.append(parse_query(q))
+            except ValueError as e:
+                return respond(timer, {"error": f"queries[{i}]: {e}"}, 400)
+        queries = parsed
+        timer.mark('parse')
+        unknown = sorted({t for t, _ in queries if t not in st.user_lbe.classes_})
+        if unknown:
+            return respond(timer, {"error": f"Unknown type: {unknown}. Supported: {list(st.user_lbe.classes_)}"}, 400)
         
-        with torch.no_grad():
-            scores = model_steam.predict(model_input, batch_size=4096)
-            
-        res_df = full_data_df.copy()
-        res_df['score'] = scores
-        # 排序并去重
-        top_items = res_df.sort_values(by='score', ascending=False).drop_duplicates(subset=['item_id']).head(top_k)
+        # 只给打分表里没有的类型现场打分，同一类型只算一次
+        live_types = sorted({t for t, _ in queries if t not in st.score_table})
+        live_ids = st.user_lbe.transform(live_types) if live_types else []
+        # 整批共用一个候选数 (按最大的 top_k)，仍然只跑一次堆叠前向
+        num_candidates = candidate_count(st, max((k for t, k in queries if t in live_types), default=None))
+        timer.mark('encode')
+        live_scores = {}
+        if live_types and scheduler is not None:
+            futures = [scheduler.submit(i, st, num_candidates) for i in live_ids]
+            live_scores = {t: f.result() for t, f in zip(live_types, futures)}
+            timer.mark('queue')
+        elif live_types:
+            all_scores = score_live(live_ids, st, num_candidates)
+            live_scores = dict(zip(live_types, all_scores))
+            timer.skip()
         
-        results = [{
-            "id": str(r['item_id']),
-            "title": r['title'],
-            "score": float(r['score']),
-            "cover": r.get('cover_url', ''),
-            "tags": r.get('tag_names', '')
-        } for _, r in top_items.iterrows()]
+        data = []
+        for user_type_str, top_k in queries:
+            if user_type_str in st.score_table:
+                results = st.score_table[user_type_str][:top_k]
+            else:
+                results = rank_items(live_scores[user_type_str], top_k, st)
+            data.append({"type": user_type_str, "data": results})
+        timer.mark('rank')
         
-        return jsonify({"code": 200, "type": user_type_str, "data": results})
+        latency_ms = (time.perf_counter() - t0) * 1000
+        if cfg.LOG_REQUESTS:
+            print(f"🎮 收到批量请求: {len(queries)} 个查询 (现场打分 {len(live_types)} 种类型), 耗时 {latency_ms:.2f} ms")
+        return respond(timer, {"code": 200, "data": data, "latency_ms": round(latency_ms, 3), "model_version": st.version})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return respond(timer, {"error": str(e)}, 500)
 
-if __name__ == '__main__':
+@app.route('/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    if scheduler is None: return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **scheduler.stats()})
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """
+    触发一次热更新: 默认立即返回 202，新版本在后台构建好后原子替换；{"wait": true} 时等构建完成再返回
+    需要在请求头 X-Admin-Token 里带上 cfg.ADMIN_TOKEN，未配置 token 时接口关闭
+    多进程模式下只有接到这个请求的 worker 会重建，其余 worker 请用 RELOAD_WATCH
+    """
+    if not cfg.ADMIN_TOKEN or request.headers.get('X-Admin-Token') != cfg.ADMIN_TOKEN:
+        return jsonify({"error": "Forbidden"}), 403
+    current = state.version if state is not None else None
+    if (request.get_json(silent=True) or {}).get('wait'):
+        st = reload_model('admin')
+        if st is None:
+            return jsonify({"error": "Reload failed, still serving the previous version", "model_version": current}), 500
+        return jsonify({"code": 200, "previous_version": current, "model_version": st.version})
+    if not start_reload('admin'):
+        return jsonify({"error": "Reload already in progress", "model_version": current}), 409
+    return jsonify({"code": 202, "model_version": current}), 202
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus 文本格式; 多进程模式下只反映处理本次抓取的那个 worker (以 pid 标签区分)
+    """
+    if scheduler is not None:
+        stats = scheduler.stats()
+        metrics.set('steam_scheduler_queue_depth', stats['queue_depth'], help_text='Pending scoring requests')
+        metrics.set('steam_scheduler_batches', stats['batches'], help_text='Forward passes run by the scheduler')
+        metrics.set('steam_scheduler_requests', stats['requests'], help_text='Scoring requests served by the scheduler')
+        metrics.set('steam_scheduler_avg_batch_size', stats['avg_batch_size'], help_text='Average requests per batch')
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+def share_model_memory():
+    """
+    fork 前把模型参数和 Item 输入张量挪进共享内存，worker 之间只读共享同一份物理页
+    """
+    try:
+        state.model.share_memory()
+    except RuntimeError as e:
+        # 量化后的 packed 参数不支持 share_memory_，这部分退化为 fork 的写时复制共享
+        print(f"⚠️ 模型参数无法放入共享内存，改用写时复制: {e}")
+    state.item_inputs.share_memory_()
+    # 冻结 fork 前的对象，GC 不再遍历它们，避免把打分表等只读对象所在的页面写脏后复制
+    gc.freeze()
+
+def serve_prefork(num_workers, host, port, threads_per_worker):
+    """
+    生产启动模式: 父进程已完成 init_model()，这里绑定端口后 fork 出 num_workers 个进程
+    各 worker 共享同一个监听 socket，由内核分发连接，绕开单进程 GIL 和单个 torch 线程池的限制
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    share_model_memory()
+    
+    children = []
+    for rank in range(num_workers):
+        pid = os.fork()
+        if pid == 0:
+            torch.set_num_threads(threads_per_worker)
+            start_scheduler()
+            start_watcher()
+            print(f"👷 worker {rank} (pid={os.getpid()}) 已启动, torch 线程数 {threads_per_worker}")
+            try:
+                make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+            except KeyboardInterrupt:
+                pass
+            os._exit(0)
+        children.append(pid)
+    print(f"🚀 多进程服务: {num_workers} 个 worker 监听 http://{host}:{port}")
+    
+    def shutdown(signum, frame):
+        for pid in children:
+            try: os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError: pass
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Steam DeepFM 推荐服务")
+    parser.add_argument("--port", type=int, default=cfg.PORT)
+    parser.add_argument("--workers", type=int, default=cfg.WORKERS, help="大于 1 时启用多进程 (prefork) 模式")
+    parser.add_argument("--threads-per-worker", type=int, default=cfg.THREADS_PER_WORKER)
+    parser.add_argument("--watch", action="store_true", default=cfg.RELOAD_WATCH, help="权重文件变化时自动热更新")
+    parser.add_argument("--admin-token", default=cfg.ADMIN_TOKEN, help="开启 POST /admin/reload 所需的 token")
+    parser.add_argument("--model", default=cfg.MODEL_PATH, help="权重文件，artifacts 按同名规则在旁边查找")
+    parser.add_argument("--no-score-table", action="store_true", help="不预计算打分表，每个请求现场打分")
+    parser.add_argument("--micro-batch", action="store_true", default=cfg.MICRO_BATCH)
+    parser.add_argument("--retrieval", choices=["exact", "ivf"], default=cfg.RETRIEVAL_INDEX if cfg.RETRIEVAL else None,
+                        help="开启两阶段召回并指定索引类型")
+    parser.add_argument("--log-requests", action="store_true", default=cfg.LOG_REQUESTS, help="每个请求打印一行 (调试用)")
+    parser.add_argument("--no-ngrok", action="store_true", help="只在本机监听，不开公网隧道 (压测 / 离线环境)")
+    args = parser.parse_args()
+    cfg.RELOAD_WATCH, cfg.ADMIN_TOKEN, cfg.MICRO_BATCH = args.watch, args.admin_token, args.micro_batch
+    cfg.LOG_REQUESTS = args.log_requests
+    if args.model != cfg.MODEL_PATH:
+        cfg.MODEL_PATH, cfg.ARTIFACTS_PATH = args.model, artifacts_path_for(args.model)
+    if args.no_score_table:
+        cfg.SCORE_TABLE = False
+    if args.retrieval:
+        cfg.RETRIEVAL, cfg.RETRIEVAL_INDEX = True, args.retrieval
+    
+    if args.workers > 1:
+        # fork 前父进程只用单线程: OpenMP 线程池在 fork 后的子进程里不可用，会卡死
+        torch.set_num_threads(1)
     init_model()
-    if not cfg.NGROK_TOKEN.startswith("这里"):
+    if not args.no_ngrok and not cfg.NGROK_TOKEN.startswith("这里"):
         ngrok.set_auth_token(cfg.NGROK_TOKEN)
         ngrok.kill()
-        try: print(f"🌍 {ngrok.connect(cfg.PORT, bind_tls=True).public_url}/recommend")
+        try: print(f"🌍 {ngrok.connect(args.port, bind_tls=True).public_url}/recommend")
         except: pass
-    app.run(port=cfg.PORT, use_reloader=False)
\ No newline at end of file
+    
+    if args.workers > 1:
+        if state is None: sys.exit(1)
+        threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+        serve_prefork(args.workers, cfg.HOST, args.port, threads)
+    else:
+        start_scheduler()
+        start_watcher()
+        app.run(host=cfg.HOST, port=args.port, use_reloader=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import io
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.preprocessing import MinMaxScaler
+from torch.utils.data import IterableDataset, get_worker_info
+from steam_features import build_input_tensor, encode_interactions, join_items, parse_tag_lists, read_items
+
+# ==========================================
+# 🌊 流式训练输入: 不把整份 CSV 读进内存
+# 第一遍按块扫描 CSV，拟合编码器 / 价格归一化，并记下每块的字节偏移；
+# 训练时各 DataLoader worker 按偏移直接 seek 到分给自己的块，只解析这一块，编码后按 batch 产出
+# 常驻内存 ≈ CHUNK_ROWS × (workers + 预取) 行，与文件大小无关；规范化格式的 Item 表常驻内存，每块读出后按 item_id 接上
+# ==========================================
+ITEM_COLUMNS = ['item_id', 'title', 'cover_url', 'tag_names', 'price', 'tags_list', 'user_type', 'label']
+
+def iter_record_chunks(path, chunk_rows):
+    """
+    按原始字节切块，每块 chunk_rows 条记录，产出 (偏移, 字节数, 行数)
+    字段里可能有带引号的换行，只有引号成对 (累计个数为偶数) 时一行才算一条记录结束
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        offset = start = len(header)
+        rows = quotes = 0
+        for line in f:
+            offset += len(line)
+            quotes += line.count(b'"')
+            if quotes % 2: continue
+            rows += 1
+            if rows == chunk_rows:
+                yield start, offset - start, rows
+                start, rows = offset, 0
+        if rows:
+            yield start, offset - start, rows
+
+class ChunkPlan:
+    """
+    CSV 的分块索引: 表头 + 每块的 (偏移, 字节数, 起始行号, 行数)；items 为规范化格式的 Item 表 (宽表时为 None)
+    """
+    def __init__(self, path, header, chunks, items=None):
+        self.path = path
+        self.header = header
+        self.chunks = chunks
+        self.items = items
+        self.num_rows = sum(n for *_, n in chunks)
+
+    def read(self, i):
+        offset, nbytes, _, _ = self.chunks[i]
+        return self.read_range(offset, nbytes)
+
+    def read_range(self, offset, nbytes):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            body = f.read(nbytes)
+        chunk = pd.read_csv(io.BytesIO(self.header + body))
+        return chunk if self.items is None else join_items(chunk, self.items)[0]
+
+def fit_vocabularies(csv_path, chunk_rows):
+    """
+    单遍扫描拟合编码器和价格归一化，结果与整表 LabelEncoder / MinMaxScaler 完全一致
+    同时按 item_id 保留每个游戏第一次出现的那一行，用来构造 Item 表 (大小只随游戏数增长)
+    返回 (encoders, scaler, 首次出现的 Item 行, ChunkPlan)
+    """
+    with open(csv_path, 'rb') as f:
+        plan = ChunkPlan(csv_path, f.readline(), [], read_items(csv_path))
+    tags, item_ids, user_types = set(), set(), set()
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    first_rows = []
+    row = 0
+    for offset, nbytes, n in iter_record_chunks(csv_path, chunk_rows):
+        chunk = plan.read_range(offset, nbytes)
+        plan.chunks.append((offset, nbytes, row, n))
+        row += n
+
+        tags.update(np.unique(parse_tag_lists(chunk['tags_list'])[0]).tolist())
+        user_types.update(chunk['user_type'].unique())
+        scaler.partial_fit(chunk[['price']])
+        new = ~chunk['item_id'].isin(item_ids) & ~chunk['item_id'].duplicated()
+        first_rows.append(chunk.loc[new, ITEM_COLUMNS])
+        item_ids.update(chunk['item_id'].unique())
+
+    # LabelEncoder 的 classes_ 就是排好序的去重值
+    encoders = {
+        'tags': np.array(sorted(tags)),
+        'item_id': np.array(sorted(item_ids)),
+        'user_type': np.array(sorted(user_types), dtype=object),
+    }
+    items = pd.concat(first_rows, ignore_index=True)
+    plan.num_rows = row
+    return encoders, scaler, items, plan
+
+class InteractionStream(IterableDataset):
+    """
+    按块流式产出 (X, y) 批次，配合 DataLoader(batch_size=None, num_workers=N) 使用
+    rows=(start, end) 限定行号区间，训练集 / 验证集各用一个实例 (验证集取最后 VALIDATION_SPLIT，与 model.fit 一致)
+    shuffle=True 时每个 epoch 打乱块的顺序和块内行的顺序 (种子为 seed + epoch，可复现)
+    多个 worker 时第 k 个 worker 只处理打乱后序号 % num_workers == k 的块
+    """
+    def __init__(self, plan, bundle, feature_index, rows, batch_size, shuffle=False, seed=0):
+        self.plan = plan
+        self.bundle = bundle
+        self.feature_index = feature_index
+        self.start, self.end = rows
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.chunk_ids = [i for i, (_, _, first, n) in enumerate(plan.chunks)
+                          if first < self.end and first + n > self.start]
+
+    def set_epoch(self, epoch):
+        # 非 persistent_workers 时每个 epoch 都会重新把 dataset 复制进 worker，所以在迭代前设置即可
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        chunk_ids = list(self.chunk_ids)
+        if self.shuffle:
+            rng.shuffle(chunk_ids)
+        info = get_worker_info()
+        if info is not None:
+            chunk_ids = chunk_ids[info.id::info.num_workers]
+            rng = np.random.default_rng([self.seed + self.epoch, info.id])
+        for i in chunk_ids:
+            _, _, first, n = self.plan.chunks[i]
+            chunk = self.plan.read(i)
+            lo, hi = max(self.start - first, 0), min(self.end - first, n)
+            chunk = chunk.iloc[lo:hi]
+            feats, labels = encode_interactions(chunk, self.bundle)
+            X = build_input_tensor(self.feature_index, feats, len(chunk))
+            y = torch.tensor(labels, dtype=torch.float32)
+            order = torch.from_numpy(rng.permutation(len(chunk))) if self.shuffle else torch.arange(len(chunk))
+            for b in range(0, len(chunk), self.batch_size):
+                idx = order[b:b + self.batch_size]
+                yield X[idx], y[idx]
@@ -1,15 +1,24 @@
-import pandas as pd
 import numpy as np
-import ast
+import argparse
+import time
 import torch
 import os
 import random
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import LabelEncoder, MinMaxScaler
-from deepctr_torch.inputs import SparseFeat, DenseFeat, VarLenSparseFeat
+from sklearn.metrics import log_loss, roc_auc_score
 from deepctr_torch.models import DeepFM
-from deepctr_torch.callbacks import EarlyStopping
+import torch.nn.functional as F
 import torch.optim as optim
+from torch.utils.data import DataLoader
+from steam_cache import feature_spec_from, load_features
+from steam_checkpoint import CheckpointManager, EpochCheckpoint, ResumableEarlyStopping, rng_state, set_rng_state
+from steam_distributed import fit_distributed
+from steam_features import (artifacts_path_for, build_feature_columns, build_input_tensor, build_item_table,
+                            encode_interactions, file_sha256, load_artifacts, read_interactions, save_artifacts,
+                            scaler_params)
+from steam_incremental import extend_encoders, grow_state_dict, merge_item_table
+from steam_profile import ProfileEpochs, profiler
+from steam_stream import InteractionStream, fit_vocabularies
 
 # ==========================================
 # ⚙️ 配置中心
@@ -17,7 +26,10 @@ import torch.optim as optim
 class SteamConfig:
     CSV_PATH = '../data/steam/deepfm_train_100k.csv'
     MODEL_PATH = 'deepfm_steam_weights.pth'
+    ARTIFACTS_PATH = artifacts_path_for(MODEL_PATH)  # 编码器/特征规格/Item 表，服务端冷启动用
     PLOT_PATH = 'training_loss.png'
+    PROFILE_PATH = 'training_profile.json'  # --profile: 预处理耗时 / 吞吐 / 取数据与计算占比 / 峰值内存
+    TRACE_PATH = 'training_trace.json'  # --profile-trace N: torch profiler 录 N 个 step 的 chrome trace
     
     MAX_TAG_LEN = 5
     EMBEDDING_DIM = 32
@@ -29,6 +41,30 @@ class SteamConfig:
     LEARNING_RATE = 0.001
     DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
     SEED = 2025
+    VALIDATION_SPLIT = 0.2
+    PATIENCE = 2  # val_auc 连续这么多个 epoch 没有提升就停
+    
+    # 流式模式: 分块读 CSV，经 IterableDataset + DataLoader 多进程喂数据，内存与文件大小无关
+    STREAMING = False
+    CHUNK_ROWS = 50_000
+    NUM_WORKERS = 2
+    EVAL_BATCH_SIZE = 4096
+    
+    # 数据并行: 大于 1 时 fork 出这么多个进程 (torch.distributed + gloo)，梯度 all-reduce，rank 0 写权重
+    NUM_PROCESSES = 1
+    
+    # 断点: 每 CHECKPOINT_EVERY 个 epoch 保存 last.pt (模型 / 优化器 / RNG / 早停状态)，val_auc 创新高时保存 best.pt
+    CHECKPOINT_DIR = 'checkpoints'
+    CHECKPOINT_EVERY = 1
+    RESTORE_BEST = True  # 训练结束后用 best.pt 的权重作为最终模型 (EarlyStopping 本身不会回滚)
+    
+    # 特征缓存: 按 CSV 内容哈希 + MAX_TAG_LEN 缓存编码后的列，之后的运行直接 memory-map
+    FEATURE_CACHE = True
+    FEATURE_CACHE_DIR = '.feature_cache'
+    
+    # 热启动增量训练: 从上一版权重 + artifacts 出发，只在新的 / 最近的交互上训几个 epoch
+    WARM_START_EPOCHS = 3
+    RECENT_ROWS = None  # 只用 CSV 最后这么多行训练 (None 为全部)；词表和 Item 表仍用整份 CSV 更新
 
 cfg = SteamConfig()
 
@@ -46,71 +82,186 @@ seed_everything(cfg.SEED)
 # ==========================================
 # 🛠️ 核心工具函数
 # ==========================================
-def pad_sequences(sequences, maxlen, value=0):
-    result = np.full((len(sequences), maxlen), value, dtype=np.int32)
-    for i, seq in enumerate(sequences):
-        if len(seq) > 0:
-            trunc = seq[:maxlen]
-            result[i, :len(trunc)] = trunc
-    return result
-
 def load_steam_data(csv_path, config):
     print(f"📂 [Train] 正在加载数据: {csv_path} ...")
-    data = pd.read_csv(csv_path)
-    
-    # 1. Tags 处理
-    data['tags_list'] = data['tags_list'].apply(lambda x: ast.literal_eval(x))
-    all_tags = [tag for sublist in data['tags_list'] for tag in sublist]
-    tag_lbe = LabelEncoder()
-    tag_lbe.fit(all_tags)
-    max_tag_id = len(tag_lbe.classes_) + 1
-    data['tags_list'] = data['tags_list'].apply(lambda x: [i+1 for i in tag_lbe.transform(x)] if len(x)>0 else [])
-    
-    # 2. ItemID 处理
-    item_lbe = LabelEncoder()
-    data['item_id_idx'] = item_lbe.fit_transform(data['item_id'])
-    max_item_id = data['item_id_idx'].max() + 1
-    
-    # 3. UserType 处理 (🔥 新增部分)
-    # 我们需要记录下有哪些 User Type，以便服务时使用
-    user_lbe = LabelEncoder()
-    data['user_type_idx'] = user_lbe.fit_transform(data['user_type'])
-    max_user_type_id = data['user_type_idx'].max() + 1
-    print(f"🔥 识别到玩家类型: {list(user_lbe.classes_)}")
-    
-    # 4. Price 处理
-    mms = MinMaxScaler(feature_range=(0, 1))
-    data['price_norm'] = mms.fit_transform(data[['price']])
-    
-    # 5. 特征定义
-    tags_padded = pad_sequences(list(data['tags_list']), maxlen=config.MAX_TAG_LEN, value=0)
-    
-    fixlen_feature_columns = [
-        SparseFeat('item_id_idx', vocabulary_size=max_item_id, embedding_dim=config.EMBEDDING_DIM),
-        # 🔥 新增：把用户类型也作为一个特征放入模型
-        SparseFeat('user_type_idx', vocabulary_size=max_user_type_id, embedding_dim=config.EMBEDDING_DIM),
-        DenseFeat('price_norm', dimension=1)
-    ]
-    
-    varlen_feature_columns = [
-        VarLenSparseFeat(
-            SparseFeat('tags', vocabulary_size=max_tag_id, embedding_dim=config.EMBEDDING_DIM),
-            maxlen=config.MAX_TAG_LEN, combiner='mean', length_name=None
-        )
-    ]
-    
-    linear_cols = fixlen_feature_columns + varlen_feature_columns
-    dnn_cols = fixlen_feature_columns + varlen_feature_columns
-    
-    # 6. 组装输入
-    model_input = {
-        'item_id_idx': data['item_id_idx'].values,
-        'user_type_idx': data['user_type_idx'].values, # 🔥 放入训练数据
-        'price_norm': data['price_norm'].values,
-        'tags': tags_padded
+    # 编码 (Tags 补齐、ItemID / UserType 的 LabelEncoder、价格归一化) 在 steam_cache.encode_csv 里；
+    # 同一份 CSV + 同样的 MAX_TAG_LEN 第二次运行直接 memory-map 缓存，不再解析
+    with profiler.stage('load_features'):
+        columns, meta = load_features(csv_path, config.MAX_TAG_LEN, config.FEATURE_CACHE_DIR if config.FEATURE_CACHE else None)
+    # 🔥 user_type_idx 也作为一个特征放入模型，记录下有哪些 User Type，以便服务时使用
+    print(f"🔥 识别到玩家类型: {list(meta['encoders']['user_type'])}")
+    
+    # 特征定义
+    with profiler.stage('feature_columns'):
+        feature_spec = feature_spec_from(meta, config.EMBEDDING_DIM)
+        linear_cols = build_feature_columns(feature_spec)
+        dnn_cols = build_feature_columns(feature_spec)
+    
+    # 组装输入
+    with profiler.stage('assemble_input'):
+        model_input = {name: columns[name] for name in ['item_id_idx', 'user_type_idx', 'price_norm', 'tags']}
+    
+    # 预处理产物: 训练完和权重一起保存，服务端直接加载
+    artifacts = {
+        'encoders': meta['encoders'],
+        'scaler': meta['scaler'],
+        'feature_spec': feature_spec,
+        'item_table': meta['item_table'],
+    }
+    
+    return model_input, linear_cols, dnn_cols, columns['label'], artifacts
+
+def load_steam_stream(csv_path, config):
+    """
+    流式模式下的 load_steam_data: 只扫一遍 CSV 拟合词表和归一化参数，不保留交互数据
+    返回 (分块索引, linear_cols, dnn_cols, 编码用的 bundle, artifacts)
+    """
+    print(f"📂 [Train] 流式扫描数据: {csv_path} (每块 {config.CHUNK_ROWS} 行) ...")
+    encoders, mms, first_rows, plan = fit_vocabularies(csv_path, config.CHUNK_ROWS)
+    print(f"🔥 识别到玩家类型: {list(encoders['user_type'])}")
+    feature_spec = {
+        'item_id_idx': len(encoders['item_id']),
+        'user_type_idx': len(encoders['user_type']),
+        'tags': len(encoders['tags']) + 1,
+        'embedding_dim': config.EMBEDDING_DIM,
+        'max_tag_len': config.MAX_TAG_LEN,
     }
+    # 与 artifacts 同结构，encode_interactions 直接用它编码每一块
+    encoding = {'encoders': encoders, 'scaler': scaler_params(mms), 'feature_spec': feature_spec}
     
-    return model_input, linear_cols, dnn_cols, data['label'].values
+    feats, _ = encode_interactions(first_rows, encoding)
+    first_rows = first_rows.assign(item_id_idx=feats['item_id_idx'], price_norm=feats['price_norm'])
+    artifacts = {
+        'encoders': encoders,
+        'scaler': mms,
+        'feature_spec': feature_spec,
+        'item_table': build_item_table(first_rows, feats['tags']),
+    }
+    print(f"🕹️ 交互记录 {plan.num_rows} 条 ({len(plan.chunks)} 块), 游戏 {len(encoders['item_id'])} 个")
+    return plan, build_feature_columns(feature_spec), build_feature_columns(feature_spec), encoding, artifacts
+
+def load_steam_warm_start(csv_path, config, base_model_path):
+    """
+    热启动模式下的 load_steam_data: 沿用上一版 artifacts 的编码器和归一化参数 (旧 id 不变)，
+    新的 item_id / tag 追加到词表末尾，Item 表合并新旧两份
+    返回值比 load_steam_data 多一个上一版的 state dict，模型建好后用 grow_state_dict 装进去
+    """
+    base = load_artifacts(artifacts_path_for(base_model_path), base_model_path)
+    spec = base['feature_spec']
+    model_spec = {'dnn_hidden_units': tuple(config.DNN_HIDDEN_UNITS), 'dnn_dropout': config.DNN_DROPOUT}
+    if (spec['embedding_dim'], spec['max_tag_len']) != (config.EMBEDDING_DIM, config.MAX_TAG_LEN) \
+            or base['model_spec'] != model_spec:
+        raise ValueError(f"上一版模型的结构与当前配置不一致 ({spec}, {base['model_spec']})，无法热启动")
+    print(f"🌱 [Train] 热启动: {base_model_path} ({len(base['encoders']['item_id'])} 个游戏, "
+          f"{len(base['encoders']['tags'])} 个 tag)")
+    
+    print(f"📂 [Train] 正在加载数据: {csv_path} ...")
+    data = read_interactions(csv_path)
+    encoders, added = extend_encoders(base['encoders'], data)
+    print(f"🆕 新增游戏 {added['item_id']} 个, 新增 tag {added['tags']} 个")
+    feature_spec = dict(spec, item_id_idx=len(encoders['item_id']), tags=len(encoders['tags']) + 1)
+    encoding = {'encoders': encoders, 'scaler': base['scaler'], 'feature_spec': feature_spec}
+    
+    feats, labels = encode_interactions(data, encoding)
+    items = build_item_table(data.assign(item_id_idx=feats['item_id_idx'], price_norm=feats['price_norm']), feats['tags'])
+    artifacts = {
+        'encoders': encoders,
+        'scaler': base['scaler'],
+        'feature_spec': feature_spec,
+        'item_table': merge_item_table(base['item_table'], items),
+    }
+    
+    # 只在最近的交互上训练 (新游戏的交互都在新数据里)
+    rows = slice(-config.RECENT_ROWS, None) if config.RECENT_ROWS else slice(None)
+    model_input = {name: feats[name][rows] for name in ['item_id_idx', 'user_type_idx', 'price_norm', 'tags']}
+    print(f"🕹️ 训练交互 {len(labels[rows])} 条 (共 {len(labels)} 条), 游戏 {len(encoders['item_id'])} 个")
+    feature_columns = build_feature_columns(feature_spec)
+    base_state = torch.load(base_model_path, map_location='cpu')
+    return model_input, feature_columns, build_feature_columns(feature_spec), labels[rows], artifacts, base_state
+
+class StreamHistory:
+    # 与 deepctr 的 History 一样通过 .history 取各 epoch 的指标，plot_and_save_loss 可以直接用
+    def __init__(self, history=None):
+        self.history = history or {}
+
+def evaluate_stream(model, loader):
+    """
+    在验证集上预测，返回 (logloss, auc)；只保留预测值和标签两列浮点数
+    """
+    model.eval()
+    preds, labels = [], []
+    with torch.no_grad():
+        for X, y in loader:
+            preds.append(model(X.to(cfg.DEVICE)).squeeze(-1).cpu().numpy().astype("float64"))
+            labels.append(y.numpy())
+    preds, labels = np.concatenate(preds), np.concatenate(labels)
+    return log_loss(labels, preds), roc_auc_score(labels, preds)
+
+def fit_stream(model, plan, encoding, config, checkpoints=None, resume=None):
+    """
+    流式训练循环，语义对齐 DeepFM.fit: 每批 loss 为 BCE(sum) + 正则项，
+    验证集取最后 VALIDATION_SPLIT 的行，按 val_auc 做 EarlyStopping
+    checkpoints 不为 None 时每个 epoch 结束保存断点；resume 为断点 dict 时从它记录的 epoch 接着训
+    """
+    split_at = int(plan.num_rows * (1. - config.VALIDATION_SPLIT))
+    train_set = InteractionStream(plan, encoding, model.feature_index, (0, split_at), config.BATCH_SIZE,
+                                  shuffle=True, seed=config.SEED)
+    val_set = InteractionStream(plan, encoding, model.feature_index, (split_at, plan.num_rows), config.EVAL_BATCH_SIZE)
+    # batch_size=None: dataset 自己按块组 batch
+    train_loader = DataLoader(train_set, batch_size=None, num_workers=config.NUM_WORKERS)
+    val_loader = DataLoader(val_set, batch_size=None, num_workers=config.NUM_WORKERS)
+    optimizer = optim.Adam(model.parameters(), lr=config.LEARNING_RATE)
+    profiler.attach(model, optimizer)
+    print(f"Train on {len(train_set)} samples, validate on {len(val_set)} samples, {config.NUM_WORKERS} loader workers")
+    
+    history = StreamHistory()
+    best_auc, wait, start_epoch = -np.inf, 0, 0
+    if resume is not None:
+        model.load_state_dict(resume['model'])
+        optimizer.load_state_dict(resume['optimizer'])
+        history = StreamHistory({name: list(values) for name, values in resume['history'].items()})
+        best_auc, wait, start_epoch = resume['best_val_auc'], resume['wait'], resume['epoch']
+        set_rng_state(resume['rng'])
+        if resume['stopped']: return history
+    for epoch in range(start_epoch, config.EPOCHS):
+        t0 = time.time()
+        profiler.epoch_begin(epoch)
+        train_set.set_epoch(epoch)
+        model.train()
+        total_loss_epoch = 0.0
+        for X, y in train_loader:
+            X, y = X.to(config.DEVICE), y.to(config.DEVICE)
+            y_pred = model(X).squeeze(-1)
+            loss = F.binary_cross_entropy(y_pred, y, reduction='sum')
+            total_loss = loss + model.get_regularization_loss() + model.aux_loss
+            optimizer.zero_grad()
+            total_loss.backward()
+            optimizer.step()
+            total_loss_epoch += total_loss.item()
+        
+        logs = {'loss': total_loss_epoch / len(train_set)}
+        if len(val_set):
+            logs['val_binary_crossentropy'], logs['val_auc'] = evaluate_stream(model, val_loader)
+        profiler.epoch_end(len(train_set))
+        for name, value in logs.items():
+            history.history.setdefault(name, []).append(value)
+        print(f"Epoch {epoch + 1}/{config.EPOCHS}\n{int(time.time() - t0)}s - "
+              + " - ".join(f"{name}: {value:.4f}" for name, value in logs.items()))
+        
+        stopped = False
+        if 'val_auc' in logs:
+            if logs['val_auc'] > best_auc:
+                best_auc, wait = logs['val_auc'], 0
+            else:
+                wait += 1
+                stopped = wait >= config.PATIENCE
+        if checkpoints is not None:
+            checkpoints.save(epoch + 1, model, optimizer, history.history, wait, rng_state(),
+                             stopped=stopped, final=epoch + 1 >= config.EPOCHS)
+        if stopped:
+            print(f"Epoch {epoch + 1:05d}: early stopping")
+            break
+    return history
 
 def plot_and_save_loss(history, save_path):
     loss = history.history['loss']
@@ -126,25 +277,113 @@ def plot_and_save_loss(history, save_path):
     print(f"📊 Loss 曲线已保存: {save_path}")
 
 if __name__ == "__main__":
-    input_dict, linear_cols, dnn_cols, target = load_steam_data(cfg.CSV_PATH, cfg)
+    parser = argparse.ArgumentParser(description="训练 Steam DeepFM")
+    parser.add_argument("--csv", default=cfg.CSV_PATH)
+    parser.add_argument("--epochs", type=int, default=None, help=f"默认 {cfg.EPOCHS}，热启动时 {cfg.WARM_START_EPOCHS}")
+    parser.add_argument("--stream", action="store_true", default=cfg.STREAMING, help="分块流式读取 CSV，内存与文件大小无关")
+    parser.add_argument("--chunk-rows", type=int, default=cfg.CHUNK_ROWS)
+    parser.add_argument("--num-workers", type=int, default=cfg.NUM_WORKERS, help="流式模式下 DataLoader 的 worker 进程数")
+    parser.add_argument("--no-cache", action="store_true", help="不读写特征缓存，每次重新解析 CSV")
+    parser.add_argument("--nproc", type=int, default=cfg.NUM_PROCESSES, help="数据并行的进程数 (gloo, CPU)")
+    parser.add_argument("--checkpoint-dir", default=cfg.CHECKPOINT_DIR)
+    parser.add_argument("--resume", action="store_true", help="从 checkpoint-dir/last.pt 接着训练")
+    parser.add_argument("--warm-start", action="store_true", help="从 --base-model 的权重和 artifacts 出发增量训练，新游戏 / tag 扩充 embedding 表")
+    parser.add_argument("--base-model", default=cfg.MODEL_PATH, help="热启动用的上一版权重 (artifacts 放在它旁边)")
+    parser.add_argument("--recent-rows", type=int, default=cfg.RECENT_ROWS, help="热启动时只用 CSV 最后这么多行训练")
+    parser.add_argument("--profile", action="store_true", help=f"记录预处理 / 训练各阶段耗时和峰值内存，写入 {cfg.PROFILE_PATH}")
+    parser.add_argument("--profile-trace", type=int, default=0, metavar="STEPS",
+                        help=f"用 torch profiler 录这么多个训练 step 的 trace ({cfg.TRACE_PATH})，隐含 --profile")
+    args = parser.parse_args()
+    if args.stream and args.nproc > 1:
+        parser.error("--stream 与 --nproc 不能同时使用")
+    if args.stream and args.warm_start:
+        parser.error("--warm-start 暂不支持 --stream")
+    cfg.EPOCHS = args.epochs or (cfg.WARM_START_EPOCHS if args.warm_start else cfg.EPOCHS)
+    cfg.CHUNK_ROWS, cfg.NUM_WORKERS, cfg.RECENT_ROWS = args.chunk_rows, args.num_workers, args.recent_rows
+    if args.no_cache: cfg.FEATURE_CACHE = False
+    if args.profile or args.profile_trace:
+        profiler.enable(args.profile_trace, cfg.TRACE_PATH)
     
-    print(f"🔧 初始化 DeepFM (含 UserType 特征)...")
-    model = DeepFM(linear_feature_columns=linear_cols, 
-                   dnn_feature_columns=dnn_cols, 
-                   task='binary', 
-                   dnn_hidden_units=cfg.DNN_HIDDEN_UNITS, 
-                   dnn_dropout=cfg.DNN_DROPOUT,
-                   device=cfg.DEVICE)
+    base_state = None
+    if args.stream:
+        with profiler.stage('load_steam_stream'):
+            plan, linear_cols, dnn_cols, encoding, artifacts = load_steam_stream(args.csv, cfg)
+    elif args.warm_start:
+        with profiler.stage('load_steam_warm_start'):
+            input_dict, linear_cols, dnn_cols, target, artifacts, base_state = load_steam_warm_start(args.csv, cfg, args.base_model)
+    else:
+        with profiler.stage('load_steam_data'):
+            input_dict, linear_cols, dnn_cols, target, artifacts = load_steam_data(args.csv, cfg)
     
-    model.compile(optimizer=optim.Adam(model.parameters(), lr=cfg.LEARNING_RATE), 
-              loss="binary_crossentropy", 
-              metrics=["binary_crossentropy", "auc"])
+    print(f"🔧 初始化 DeepFM (含 UserType 特征)...")
+    with profiler.stage('build_model'):
+        model = DeepFM(linear_feature_columns=linear_cols, 
+                       dnn_feature_columns=dnn_cols, 
+                       task='binary', 
+                       dnn_hidden_units=cfg.DNN_HIDDEN_UNITS, 
+                       dnn_dropout=cfg.DNN_DROPOUT,
+                       device=cfg.DEVICE)
+        if base_state is not None:
+            model.load_state_dict(grow_state_dict(base_state, model))
     
-    es = EarlyStopping(monitor='val_auc', min_delta=0, patience=2, mode='max')
+    model_spec = {'dnn_hidden_units': tuple(cfg.DNN_HIDDEN_UNITS), 'dnn_dropout': cfg.DNN_DROPOUT}
+    # 断点只能在同样的数据、结构和训练模式下恢复
+    mode = 'stream' if args.stream else ('ddp' if args.nproc > 1 else 'fit')
+    checkpoints = CheckpointManager(args.checkpoint_dir, every=cfg.CHECKPOINT_EVERY, meta={
+        'mode': mode, 'processes': args.nproc if mode == 'ddp' else 1, 'batch_size': cfg.BATCH_SIZE,
+        'rows': plan.num_rows if args.stream else len(target),
+        'feature_spec': artifacts['feature_spec'], 'model_spec': model_spec,
+        'base_weights': file_sha256(args.base_model) if args.warm_start else None,
+    })
+    resume = checkpoints.resume() if args.resume else None
+    if resume is not None:
+        print(f"♻️ 从断点恢复: {checkpoints.last_path} (已完成 {resume['epoch']} 个 epoch, best val_auc {resume['best_val_auc']:.4f})")
     
     print(f"🚀 开始训练 (Epochs: {cfg.EPOCHS}, Batch: {cfg.BATCH_SIZE})...")
-    history = model.fit(input_dict, target, batch_size=cfg.BATCH_SIZE, epochs=cfg.EPOCHS, verbose=2, validation_split=0.2, callbacks=[es])
+    if args.stream:
+        history = fit_stream(model, plan, encoding, cfg, checkpoints, resume)
+    elif args.nproc > 1:
+        with profiler.stage('build_input_tensor'):
+            X = build_input_tensor(model.feature_index, input_dict, len(target))
+        history = StreamHistory(fit_distributed(model, X, torch.tensor(target, dtype=torch.float32), cfg, args.nproc,
+                                                checkpoints, resume))
+    else:
+        model.compile(optimizer=optim.Adam(model.parameters(), lr=cfg.LEARNING_RATE), 
+                  loss="binary_crossentropy", 
+                  metrics=["binary_crossentropy", "auc"])
+        profiler.attach(model, model.optim)
+        
+        es = ResumableEarlyStopping(monitor='val_auc', min_delta=0, patience=cfg.PATIENCE, mode='max')
+        ckpt = EpochCheckpoint(checkpoints, es, cfg.EPOCHS)
+        if base_state is not None:
+            # 上一版 fit 在第一次验证之后都是 eval 模式 (无 dropout) 下训练的，热启动沿用这个模式微调，
+            # 否则突然打开 dropout 会先把已经学好的模型打乱
+            ckpt.training_mode = False
+        initial_epoch = 0
+        if resume is not None:
+            es.resume_best, es.resume_wait = resume['best_val_auc'], resume['wait']
+            ckpt.history = {name: list(values) for name, values in resume['history'].items()}
+            ckpt.training_mode = resume['training']
+            model.load_state_dict(resume['model'])
+            model.optim.load_state_dict(resume['optimizer'])
+            # fit 开始到第一个 epoch 之间不消耗随机数，在这里恢复 RNG 即可让后续 epoch 与不中断时逐位一致
+            set_rng_state(resume['rng'])
+            initial_epoch = cfg.EPOCHS if resume['stopped'] else resume['epoch']
+        model.fit(input_dict, target, batch_size=cfg.BATCH_SIZE, epochs=cfg.EPOCHS, verbose=2, initial_epoch=initial_epoch,
+                  validation_split=cfg.VALIDATION_SPLIT,
+                  callbacks=[ProfileEpochs(profiler, int(len(target) * (1. - cfg.VALIDATION_SPLIT))), es, ckpt])
+        history = StreamHistory(ckpt.history)  # 含恢复前的 epoch
     
-    torch.save(model.state_dict(), cfg.MODEL_PATH)
-    print(f"✅ 模型已保存: {cfg.MODEL_PATH}")
-    plot_and_save_loss(history, cfg.PLOT_PATH)
\ No newline at end of file
+    if cfg.RESTORE_BEST:
+        best = checkpoints.restore_best(model)
+        if best is not None:
+            print(f"🏆 使用 val_auc 最好的第 {best[0]} 个 epoch 的权重 (val_auc {best[1]:.4f})")
+    with profiler.stage('save'):
+        torch.save(model.state_dict(), cfg.MODEL_PATH)
+        print(f"✅ 模型已保存: {cfg.MODEL_PATH}")
+        save_artifacts(cfg.ARTIFACTS_PATH, model_spec=model_spec, weights_path=cfg.MODEL_PATH, **artifacts)
+        print(f"📦 预处理产物已保存: {cfg.ARTIFACTS_PATH}")
+    plot_and_save_loss(history, cfg.PLOT_PATH)
+    profiler.write(cfg.PROFILE_PATH, mode=mode, csv=args.csv, epochs=cfg.EPOCHS, batch_size=cfg.BATCH_SIZE,
+                   processes=args.nproc if mode == 'ddp' else 1, num_workers=cfg.NUM_WORKERS if args.stream else 0,
+                   cpu_count=os.cpu_count())
\ No newline at end of file